@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Adam (adam_gr [at] gazeta.pl)
+#
+# Released under: GNU GENERAL PUBLIC LICENSE
+#
+# Ver: 0.5
+
+import errno
+import os
+import re
+import tempfile
+try:
+    import fcntl
+except ImportError:
+    #np. Windows - pliki blokowane sa tylko miedzy watkami jednego procesu
+    fcntl = None
+
+#katalog na dane zapamietywane pomiedzy uruchomieniami programu
+cache_dir = os.path.join(os.path.expanduser('~'), '.chomikuploader')
+
+
+def cache_path(name, user = None):
+    """
+    Zwraca sciezke do pliku name w katalogu cache_dir
+    (dla user: name_user, np. folders_nazwa_chomika.txt)
+    """
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir, 0700)
+        except OSError, e:
+            #katalog mogl zostac utworzony w miedzyczasie przez inny watek
+            if e.errno != errno.EEXIST:
+                raise
+    if user != None:
+        base, ext = os.path.splitext(name)
+        name = base + '_' + re.sub(r'[^\w.-]', '_', user) + ext
+    return os.path.join(cache_dir, name)
+
+
+def write_atomic(path, data, mode = 0600):
+    """
+    Zapisuje data do pliku path tak, zeby po przerwaniu programu
+    nie zostal uszkodzony plik
+    """
+    #unikalna nazwa - plik moze zapisywac naraz kilka procesow
+    fd, tmp = tempfile.mkstemp(prefix = os.path.basename(path) + '.', suffix = '.tmp', dir = os.path.dirname(path) or '.')
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        #mkstemp tworzy plik z prawami 0600
+        if mode != 0600:
+            os.chmod(tmp, mode)
+        replace(tmp, path)
+    except:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def lock_file(fd):
+    """
+    Blokada (flock) pliku o deskryptorze fd - wylaczny dostep dla jednego
+    procesu (bez fcntl: nic nie robi)
+    """
+    if fcntl != None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+
+def unlock_file(fd):
+    if fcntl != None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def replace(src, dst):
+    """
+    os.rename zastepujacy istniejacy plik dst rowniez na Windows
+    (tam nie jest to jednak operacja atomowa)
+    """
+    try:
+        os.rename(src, dst)
+    except OSError:
+        if not os.path.exists(dst):
+            raise
+        os.remove(dst)
+        os.rename(src, dst)
@@ -8,6 +8,7 @@
 #
 # Ver: 0.5
 
+import atexit
 import socket
 import urllib2
 import hashlib
@@ -23,8 +24,14 @@ import model
 import time
 import cgi
 import random
+import transfer
 ##################
 from soap import SOAP
+from connection import ConnectionPool, read_response
+import folders
+import resolver
+import session
+from folders import FolderTree, unescape_name
 
 
 def debug_fun(tb):
@@ -86,6 +93,8 @@ def unescape(string):
         return result
 ###########################################################
 glob_timeout = 20
+#czas (w sekundach), po ktorym token pobrany z wyprzedzeniem uznawany jest za niewazny
+upload_token_ttl = 240
 #KONFIGURACJA
 #login_ip   = "208.43.223.12"
 #login_ip   = "main.box.chomikuj.pl"
@@ -95,6 +104,18 @@ login_port = 80
 version = "2.0.8.1"
 client = "ChomikBox-" + version
 
+#wspolna dla wszystkich obiektow Chomik pula polaczen do uslugi SOAP
+soap_pool = ConnectionPool(login_ip, login_port, timeout = glob_timeout)
+#polaczenia keep-alive zamykane sa przy zakonczeniu programu
+atexit.register(soap_pool.close_all)
+
+def node_text(node):
+    """
+    Tekst elementu xml (elementy z atrybutami sa slownikami)
+    """
+    if type(node) == dict:
+        return node.get('#text')
+    return node
 
 def change_coding(text):
     try:
@@ -105,6 +126,8 @@ def change_coding(text):
     return text
 
 def to_unicode(text):
+    if type(text) == unicode:
+        return text
     try:
         if sys.platform.startswith('win'):
             text = text.decode('cp1250')
@@ -118,14 +141,6 @@ def to_unicode(text):
 def escape_name(text):  
     return cgi.escape(text)
 
-def unescape_name(text):
-    text = text.replace("&quot;", '"')
-    text = text.replace("&apos;", "'")
-    text = text.replace("&lt;", "<")
-    text = text.replace("&gt;", ">")
-    text = text.replace("&amp;", "&")
-    return text
-
 #####################################################################################################
 class ChomikException(Exception):
     def __init__(self, filepath, filename, folder_id, chomik_id, token, server, port, stamp, excpt = None):
@@ -152,7 +167,7 @@ class ChomikException(Exception):
 #####################################################################################################
 #TODO: zmienic cos z kodowaniem
 class Chomik(object):
-    def __init__(self, view_ = None, model_ = None, debug = False):
+    def __init__(self, view_ = None, model_ = None, debug = False, lazy = False):
     	#reload(sys)
     	#sys.setdefaultencoding('utf8')
         if view_ == None:
@@ -165,43 +180,58 @@ class Chomik(object):
             self.model   = model_
         self.soap          = SOAP()
         ########
-        #root folder
-        self.folders_dom   = {}
+        #indeks drzewa katalogow
+        self.folders       = FolderTree()
         self.ses_id        = ''
         self.chomik_id     = '0'
         self.folder_id     = '0'
         self.cur_fold      = []
         self.user          = ''
         self.password      = ''
-        self.last_login    = 0
+        #sesja wspolna dla wszystkich watkow (ustawiana przy logowaniu)
+        self.session       = None
         self.debug         = debug
         self.cookie        = ''
+        #tryb leniwy: pobieramy tylko podkatalogi katalogow, do ktorych wchodzimy
+        self.lazy          = lazy
 
 
     def send(self, content):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(glob_timeout)
-        sock.connect( (login_ip, login_port) )
-        sock.send(content)
-        resp = ""
-        kRespSize = 2056
+        #polaczenie z puli moglo zostac zamkniete przez serwer - wtedy
+        #probujemy jeszcze raz na nowym polaczeniu
         while True:
-            tmp = sock.recv(kRespSize)
-            resp   += tmp
-            #if tmp ==  '' or tmp.endswith("\r\n\r\n"):
-            if tmp.endswith("\r\n\r\n") and resp.count("\r\n\r\n") >= 2 or tmp == '':
-                break
-        sock.close()
-        if "Set-Cookie: __cfduid=" in resp:
-            self.cookie = re.findall("Set-Cookie: __cfduid=([^;]*)", resp)[0]
-        resp = resp.partition("\r\n\r\n")[2]
-        resp = re.sub("\r\n\w{1,10}\r\n", "", resp)
-        _, _, resp = resp.partition("<")
-        resp = "<" + resp
-        resp,_,_ = resp.rpartition(">")
-        resp = resp + ">"
-        return resp
-                
+            sock, reused = soap_pool.acquire()
+            try:
+                sock.sendall(content)
+                resp = read_response(sock)
+            except (socket.error, socket.timeout), e:
+                soap_pool.discard(sock, reconnect = reused)
+                if reused:
+                    continue
+                raise
+            break
+        if resp.keep_alive():
+            soap_pool.release(sock)
+        else:
+            soap_pool.discard(sock)
+        return self.response_body(resp)
+
+    def response_body(self, resp):
+        """
+        Zapamietuje ciasteczko z odpowiedzi (connection.Response) i zwraca
+        jej tresc (xml)
+        """
+        for cookie in resp.cookies:
+            if cookie.startswith("__cfduid="):
+                self.cookie = cookie[len("__cfduid="):].partition(";")[0]
+        #tresc odpowiedzi trafia bezposrednio do parsera xml
+        body  = resp.body
+        start = body.find("<")
+        end   = body.rfind(">")
+        if start > 0 or end < len(body) - 1:
+            body = body[start:end + 1]
+        return body
+        
         
     def login(self, user, password):
         """
@@ -210,8 +240,17 @@ class Chomik(object):
         """
         self.user          = user
         self.password      = password
+        self.session       = None
         if self.relogin() == True:
-            self.get_dir_list()
+            #indeks katalogow jest wspolny dla wszystkich watkow i zapisywany na dysku
+            self.folders = folders.shared_tree(user)
+            self.folders.lock.acquire()
+            try:
+                if self.folders.empty() and not self.lazy:
+                    self.get_dir_list()
+                    self.__save_folders()
+            finally:
+                self.folders.lock.release()
             return True
         else:
             return False
@@ -219,10 +258,40 @@ class Chomik(object):
 
     
     def relogin(self):
-        #we log in recently
-        if self.last_login + 300 > time.time():
-            return True
-        self.last_login = time.time()
+        """
+        Pobiera token sesji wspolnej dla wszystkich watkow (session.Session);
+        logowanie odbywa sie tylko wtedy, gdy nie ma waznej sesji
+        """
+        if self.session == None:
+            self.session = session.shared_session(self.user, self.password, self.auth)
+        current = self.session.get()
+        if current == None:
+            return False
+        self.ses_id, self.chomik_id = current
+        return True
+
+    def session_ready(self):
+        """
+        Czy relogin() zwroci token bez logowania (Auth)
+        """
+        if self.session == None:
+            self.session = session.shared_session(self.user, self.password, self.auth)
+        return self.session.ready()
+
+    def session_rejected(self):
+        """
+        Wywolywane po bledzie uslugi SOAP. Zwraca True, gdy uzyty token
+        sesji mogl zostac odrzucony przez serwer (session.Session.rejected) -
+        po ponownym logowaniu warto powtorzyc zapytanie
+        """
+        if self.session == None or not self.session.rejected(self.ses_id):
+            return False
+        return self.relogin()
+
+    def auth(self):
+        """
+        Logowanie (Auth). Zwraca (ses_id, chomik_id) lub None przy bledzie
+        """
         password = hashlib.md5(self.password).hexdigest()
         xml_dict = [('ROOT',[('name' , self.user), ('passHash', password), ('ver' , '4'), ('client',[('name','chomikbox'),('version',version) ]) ])]
         xml_content = self.soap.soap_dict_to_xml(xml_dict, "Auth").strip()
@@ -244,30 +313,30 @@ class Chomik(object):
         if status != 'Ok':
             self.view.print_( "Blad(relogin):" )
             self.view.print_( status )
-            return False
+            return None
         try:
             chomik_id = resp_dict['s:Envelope']['s:Body']['AuthResponse']['AuthResult']['a:hamsterId']
             ses_id    = resp_dict['s:Envelope']['s:Body']['AuthResponse']['AuthResult']['a:token'] 
-            self.ses_id    = ses_id
-            self.chomik_id = chomik_id
-            if self.ses_id == "-1" or self.chomik_id == "-1":
-                return False 
+            if ses_id == "-1" or chomik_id == "-1":
+                return None
         except IndexError, e:
             self.view.print_( "Blad(relogin):" )
             self.view.print_( e )
             #self.view.print_( resp )
-            return False
+            return None
         else:
-            return True
+            return ses_id, chomik_id
         
         
 
-    def get_dir_list(self, folder_id = 0, folder_dom_root = {}):
+    def get_dir_list(self, folder_id = 0, depth = 0):
         """
-        Pobiera liste folderow chomika.
+        Pobiera liste folderow chomika (poddrzewo katalogu folder_id)
+        i dodaje je do indeksu katalogow.
+        depth == 0 oznacza cale poddrzewo, depth == 1 tylko podkatalogi.
         """
         self.relogin()
-        xml_dict = [('ROOT',[('token' , self.ses_id), ('hamsterId', self.chomik_id), ('folderId' , folder_id), ('depth' , 0) ])]
+        xml_dict = [('ROOT',[('token' , self.ses_id), ('hamsterId', self.chomik_id), ('folderId' , folder_id), ('depth' , depth) ])]
         xml_content = self.soap.soap_dict_to_xml(xml_dict, "Folders").strip()
         xml_len = len(xml_content)
         header  = """POST /services/ChomikBoxService.svc HTTP/1.1\r\n"""
@@ -286,18 +355,36 @@ class Chomik(object):
         resp_dict =  self.soap.soap_xml_to_dict(resp)
         status = resp_dict['s:Envelope']['s:Body']['FoldersResponse']['FoldersResult']['a:status']
         if status != 'Ok':
+            if self.session_rejected():
+                return self.get_dir_list(folder_id, depth)
             self.view.print_( "Blad(pobieranie listy folderow):" )
             self.view.print_( status )        
             return False
-        if folder_id == 0:
-            self.folders_dom = resp_dict['s:Envelope']['s:Body']['FoldersResponse']['FoldersResult']['a:folder']
+        dom = resp_dict['s:Envelope']['s:Body']['FoldersResponse']['FoldersResult']['a:folder']
+        if depth == 1:
+            self.folders.load_dom(dom, str(folder_id))
+            self.folders.mark_listed(str(folder_id))
+        elif folder_id == 0:
+            self.folders.clear()
+            self.folders.load_dom(dom)
+            self.folders.mark_refreshed(self.folders.root_id)
         else:
-            #print "Get list dir:",  resp_dict['s:Envelope']['s:Body']['FoldersResponse']['FoldersResult']['a:folder']
-            #FIXME danger
-            folder_dom_root[u'folders'] = resp_dict['s:Envelope']['s:Body']['FoldersResponse']['FoldersResult']['a:folder'][u'folders']
-            return True
+            self.folders.load_dom(dom, folder_id)
+            self.folders.mark_refreshed(folder_id)
+        self.__save_folders(force = False)
         return True
 
+    def __save_folders(self, force = True):
+        """
+        Zapis indeksu katalogow - blad zapisu nie przerywa wysylania
+        (indeks zostanie zapisany pozniej lub pobrany ponownie)
+        """
+        try:
+            self.folders.save(force)
+        except (IOError, OSError), e:
+            if self.debug:
+                self.view.print_( 'Nie udalo sie zapisac indeksu katalogow:', e )
+
 
     
     def cur_adr(self, atr = None):
@@ -328,81 +415,128 @@ class Chomik(object):
                 #f = f[:100]
                 fold.append(f)
         folders   = fold
-        fold      = []
-        folder_id = '0'
-        #pobieranie listy folderow
-        result, dom, folder_id = self.__access_node(folders)
-        if result == True:
-            self.cur_fold  = folders
-            self.folder_id = folder_id
-        else:
-            result, dom, folder_id = self.__create_nodes(folders)
-            if result == False:
-                return False
+        folder_id = self.__resolve(folders)
+        if folder_id == None:
+            return False
         self.cur_fold  = folders
         self.folder_id = folder_id
         return True
     
 
     
-    def __access_node(self, folders_list):
-        """
-        Odwiedza kolejne wezly drzewa xmlowego wypisane na liscie folder_list.
-        Jezeli jakiego wezla nie ma, to zwracany jest (False,None,None).
-        JEzeli wszystkie wezly istnieja, to zwracane jest 
-        (True, poddrzewo ostatniego wezla na liscie, folder_id ostatniego wezla na liscie)
-        """
-        dom       = self.folders_dom
-        fold      = []
-        folder_id = '0'
-        for f in folders_list:
-            list_of_subfolders = dom.get('folders', {}).get('FolderInfo', {})
-            if type(list_of_subfolders) == dict:
-                list_of_subfolders = [list_of_subfolders]
-            name = self.__dirname_refinement(f)
-            name = to_unicode(name)
-            if name in [unescape_name(i.get("name","")) for i in list_of_subfolders ]:
-                for i in list_of_subfolders:
-                    if name == unescape_name(i.get("name","")):
-                        dom       = i
-                        folder_id = i["id"]
-                        break
-            else:
-                return (False, None, None)
-        return (True,dom, folder_id)
+    def resolve(self, directories):
+        """
+        Zwraca id katalogu o sciezce directories (np. "/katalog1/katalog2")
+        liczonej od korzenia chomika. Brakujace katalogi sa tworzone.
+        Nie zmienia obecnego katalogu, wiec moze byc wywolywane
+        jednoczesnie z wielu watkow. Zwraca None w razie bledu.
+        """
+        folders = [i for i in directories.split('/') if i != '']
+        return self.__resolve(folders)
 
 
+    def __resolve(self, folders_list, refined = False):
+        """
+        refined == True - nazwy w folders_list sa juz oczyszczone (pochodza
+        z indeksu katalogow) i nie sa ponownie poprawiane
+        """
+        if refined:
+            names = [to_unicode(f) for f in folders_list]
+        else:
+            names = self.__node_names(folders_list)
+        #pobieranie id katalogu z indeksu
+        folder_id = self.__access_node(names)
+        if folder_id == None:
+            folder_id = self.__refresh_nodes(names)
+        if folder_id == None:
+            folder_id = self.__create_nodes(folders_list, names, refined)
+        return folder_id
     
-    def __create_nodes(self, folder_list):
-        folder_id = '0'
-        fold      = []
-        #self.get_dir_list()
-        dom       = self.folders_dom
-        for f in folder_list:
-            list_of_subfolders = dom.get('folders', {}).get('FolderInfo', {})
-            if type(list_of_subfolders) == dict:
-                list_of_subfolders = [list_of_subfolders]
-            name = self.__dirname_refinement(f)
-            name = to_unicode(name)
-            if name in [unescape_name(i.get("name","")) for i in list_of_subfolders ]:
-                for i in list_of_subfolders:
-                    if name == unescape_name(i.get("name","")):
-                        dom       = i
-                        folder_id = i["id"]
-                        fold.append(f)
-                        break
-                        #self.view.print_( folder_id, f )
-            else:
-                #TODO: update self.folder_dom
-                self.mkdir(name, folder_id)
-                self.get_dir_list(folder_id, dom)
-                result, dom, folder_id = self.__access_node(fold + [f])
-                #jezeli nie udalo sie ani utworzyc ani przejsc, to zwroc False
-                if result == False:
-                    return (False, None, None)
-                else:
-                    fold.append(f)
-        return (True,dom, folder_id)
+
+    
+    def __node_names(self, folders_list):
+        return [to_unicode(self.__dirname_refinement(f)) for f in folders_list]
+
+
+    def find_dir(self, dirname, folder_id):
+        """
+        Zwraca id podkatalogu dirname katalogu folder_id (lub None, gdy nie istnieje).
+        W trybie leniwym pobiera w razie potrzeby liste podkatalogow folder_id.
+        """
+        name     = to_unicode(self.__dirname_refinement(dirname))
+        child_id = self.folders.child(folder_id, name)
+        if child_id == None and self.lazy and not self.folders.is_listed(folder_id):
+            self.get_dir_list(folder_id, depth = 1)
+            child_id = self.folders.child(folder_id, name)
+        return child_id
+
+
+    def __access_node(self, names):
+        """
+        Zwraca id katalogu o sciezce names lub None, jezeli
+        ktorys z katalogow na sciezce nie istnieje.
+        """
+        return self.folders.lookup(names)
+
+
+    
+    def __refresh_nodes(self, names):
+        """
+        Indeks wczytany z pliku mogl sie zdezaktualizowac - pobiera ponownie
+        poddrzewo najglebszego znanego katalogu na sciezce names.
+        Zwraca id katalogu lub None.
+        """
+        if self.lazy:
+            return self.__list_nodes(names)
+        depth, folder_id = self.folders.longest_prefix(names)
+        if self.folders.is_fresh(folder_id):
+            return None
+        if folder_id == self.folders.root_id:
+            self.get_dir_list()
+        else:
+            self.get_dir_list(folder_id)
+        return self.folders.lookup(names)
+
+
+    def __list_nodes(self, names):
+        """
+        Tryb leniwy: schodzi po sciezce names, pobierajac (tylko raz w danym
+        uruchomieniu) liste podkatalogow kazdego katalogu na sciezce.
+        Zwraca id katalogu lub None.
+        """
+        depth, folder_id = self.folders.longest_prefix(names)
+        while depth < len(names):
+            if self.folders.is_listed(folder_id):
+                return None
+            self.get_dir_list(folder_id, depth = 1)
+            depth, folder_id = self.folders.longest_prefix(names)
+        return folder_id
+
+
+    
+    def __create_nodes(self, folders_list, names, refined = False):
+        """
+        Tworzy brakujace katalogi na sciezce folders_list (names - nazwy
+        w postaci uzywanej w indeksie katalogow).
+        Zwraca id ostatniego katalogu lub None.
+        """
+        depth, folder_id = self.folders.longest_prefix(names)
+        for f, name in zip(folders_list[depth:], names[depth:]):
+            #ten sam katalog moze probowac utworzyc kilka watkow naraz
+            lock = self.folders.creation_lock(folder_id, name)
+            lock.acquire()
+            try:
+                child_id = self.folders.child(folder_id, name)
+                if child_id == None:
+                    #mkdir od razu dodaje nowy katalog do indeksu
+                    child_id = self.mkdir(f, folder_id, refined)
+            finally:
+                lock.release()
+            #jezeli nie udalo sie ani utworzyc ani przejsc, to zwroc None
+            if not child_id:
+                return None
+            folder_id = child_id
+        return folder_id
     
 
     def __dirname_refinement(self, dirname):
@@ -422,15 +556,23 @@ class Chomik(object):
         dirname = dirname.encode('utf8')
         return dirname
     
-    def mkdir(self, dirname, folder_id = None):
+    def mkdir(self, dirname, folder_id = None, refined = False):
         """
         Tworzenie katalogu w katalogu o id = folder_id
+        (refined == True - nazwa jest juz oczyszczona z niedozwolonych znakow)
+        Zwraca id nowego (lub juz istniejacego) katalogu albo False
         """
         #if len(dirname) > 100:
         #    self.view.print_( "Dirname too long" )
         #    self.view.print_( "Dirname shortened\r\n" )
         #    dirname = to_unicode(dirname).encode("utf8")
-        dirname = self.__dirname_refinement(dirname)
+        orig_dirname = dirname
+        if refined:
+            dirname = to_unicode(dirname).encode('utf8')
+        else:
+            dirname = self.__dirname_refinement(dirname)
+        #nazwa w postaci uzywanej w indeksie katalogow
+        name    = to_unicode(dirname)
         self.relogin()
         if folder_id == None:
             folder_id = self.folder_id
@@ -455,19 +597,38 @@ class Chomik(object):
         header += xml_content
         resp = self.send(header)
         resp_dict =  self.soap.soap_xml_to_dict(resp)
-        status = resp_dict['s:Envelope']['s:Body']['AddFolderResponse']['AddFolderResult']['status']['#text']
+        result = resp_dict['s:Envelope']['s:Body']['AddFolderResponse']['AddFolderResult']
+        status = result['status']['#text']
         if status == 'Ok':
             self.view.print_( "Creation success\r\n" )
-            return True
+            new_id = node_text( result.get('folderId', result.get('a:folderId')) )
+            if new_id == None:
+                return self.__find_child(folder_id, name)
+            self.folders.add(folder_id, name, new_id)
+            #nowy katalog jest pusty
+            self.folders.mark_listed(new_id)
+            return new_id
         else:
-            error_msg = resp_dict['s:Envelope']['s:Body']['AddFolderResponse']['AddFolderResult']['errorMessage']['#text']
+            error_msg = result['errorMessage']['#text']
             if error_msg == 'NameExistsAtDestination':
-                return True
+                return self.__find_child(folder_id, name)
+            elif self.session_rejected():
+                return self.mkdir(orig_dirname, folder_id, refined)
             else:
                 self.view.print_( "Creation fail" )
                 self.view.print_( error_msg )
                 return False
 
+    def __find_child(self, folder_id, name):
+        """
+        Pobiera liste podkatalogow folder_id i zwraca id podkatalogu name (lub False)
+        """
+        self.get_dir_list(folder_id, depth = 1)
+        child_id = self.folders.child(folder_id, name)
+        if child_id == None:
+            return False
+        return child_id
+
     def rmdir(self):
         """
         Usuwanie obecnego katalogu
@@ -503,25 +664,68 @@ class Chomik(object):
 
         
     ###########################################################################
-    def upload(self, filepath, filename):
+    def upload(self, filepath, filename, folder_id = None, tokens = None):
+        """
+        Wysyla plik filepath jako filename do katalogu folder_id
+        (domyslnie do obecnego katalogu).
+        tokens - tokeny pobrane wczesniej przez prefetch_upload_tokens
+        """
         self.relogin()
+        if folder_id == None:
+            folder_id = self.folder_id
         filename_tmp               = change_coding(filename)
         filename_tmp               = escape_name(filename_tmp)
         self.model.add_notuploaded_normal(filepath)
-        token, stamp, server, port = self.__upload_get_tokens(filepath, filename)
+        if tokens != None and time.time() - tokens[4] > upload_token_ttl:
+            #token mogl juz wygasnac - pobieramy nowy
+            tokens = None
+        if tokens != None:
+            token, stamp, server, port = tokens[:4]
+        else:
+            token, stamp, server, port = self.__upload_get_tokens(filepath, filename, folder_id)
+        if token == None and self.session_rejected():
+            token, stamp, server, port = self.__upload_get_tokens(filepath, filename, folder_id)
+        if token == None and not self.folders.is_fresh(folder_id):
+            #katalog z indeksu zapisanego na dysku mogl zostac usuniety z chomika
+            folder_id = self.__refresh_dir(folder_id)
+            if folder_id != None:
+                token, stamp, server, port = self.__upload_get_tokens(filepath, filename, folder_id)
         #saving information for resuming
-        self.model.add_notuploaded_resume(filepath, filename, self.folder_id, self.chomik_id, token, server, port, stamp)
+        self.model.add_notuploaded_resume(filepath, filename, folder_id, self.chomik_id, token, server, port, stamp)
         if token == None:
             return False
         else:
-            result = self.__upload_with_resume_option( filepath, filename, token, stamp, server, port, self.chomik_id, self.folder_id)
+            result = self.__upload_with_resume_option( filepath, filename, token, stamp, server, port, self.chomik_id, folder_id)
             if result == True:
                 self.model.remove_notuploaded(filepath)
             return result
         
+    def upload_retry_folder(self, folder_id):
+        """
+        Nie udalo sie pobrac tokenu do wyslania pliku do katalogu folder_id.
+        Zwraca id katalogu, dla ktorego warto ponowic probe (po ponownym
+        zalogowaniu lub odswiezeniu indeksu katalogow), lub None
+        """
+        if self.session_rejected():
+            return folder_id
+        if not self.folders.is_fresh(folder_id):
+            return self.__refresh_dir(folder_id)
+        return None
+
+    def __refresh_dir(self, folder_id):
+        """
+        Usuwa katalog z indeksu i ponownie ustala jego id (tworzac go, jezeli trzeba)
+        """
+        names = self.folders.path_of(folder_id)
+        if names == None:
+            return None
+        self.folders.remove(folder_id)
+        #nazwy z indeksu sa juz oczyszczone
+        return self.__resolve(names, refined = True)
+        
     def __upload_with_resume_option(self, filepath, filename, token, stamp, server, port, chomik_id, folder_id):
         try:
-            result = self.__upload(filepath, filename, token, stamp, server, port)
+            result = self.__upload(filepath, filename, token, stamp, server, port, chomik_id, folder_id)
         except (socket.error, socket.timeout), e:
             self.view.print_("Wznawianie\n")
             result = self.resume(filepath, filename, folder_id, chomik_id, token, server, port, stamp)
@@ -530,13 +734,28 @@ class Chomik(object):
             
 
 
-    def __upload_get_tokens(self, filepath, filename):
+    def __upload_get_tokens(self, filepath, filename, folder_id):
         """
         Pobiera informacje z serwera o tym gdzie i z jakimi parametrami wyslac plik
         """
-        #Pobieranie informacji o serwerze
-        filename_len = len(filename)
-        xml_dict = [('ROOT',[('token' , self.ses_id), ('folderId' , self.folder_id), ('fileName', filename) ])]
+        resp = self.send(self.upload_token_request(filename, folder_id))
+        return self.parse_upload_token(resp)
+
+    def prefetch_upload_tokens(self, filename, folder_id):
+        """
+        Pobiera z wyprzedzeniem tokeny do wyslania pliku (dla upload).
+        Zwraca (token, stamp, serwer, port, czas_pobrania) lub None przy bledzie
+        """
+        token, stamp, server, port = self.__upload_get_tokens(None, filename, folder_id)
+        if token == None:
+            return None
+        return token, stamp, server, port, time.time()
+
+    def upload_token_request(self, filename, folder_id):
+        """
+        Zapytanie UploadToken (o serwer i parametry wysylania pliku)
+        """
+        xml_dict = [('ROOT',[('token' , self.ses_id), ('folderId' , folder_id), ('fileName', filename) ])]
         xml_content = self.soap.soap_dict_to_xml(xml_dict, "UploadToken").strip()
         xml_len = len(xml_content)
         header  = """POST /services/ChomikBoxService.svc HTTP/1.1\r\n"""
@@ -550,7 +769,13 @@ class Chomik(object):
         header += """User-Agent: Mozilla/5.0\r\n"""
         header += """Host: box.chomikuj.pl\r\n\r\n"""
         header += xml_content
-        resp = self.send(header)
+        return header
+
+    def parse_upload_token(self, resp):
+        """
+        Zwraca (token, stamp, serwer, port) z odpowiedzi na UploadToken
+        (lub same None przy bledzie)
+        """
         resp_dict =  self.soap.soap_xml_to_dict(resp)
         status = resp_dict['s:Envelope']['s:Body']['UploadTokenResponse']['UploadTokenResult']['a:status']
         if status != 'Ok':
@@ -558,12 +783,11 @@ class Chomik(object):
             self.view.print_( status )
             return None, None, None, None
         try:
-            self.token  = resp_dict['s:Envelope']['s:Body']['UploadTokenResponse']['UploadTokenResult']['a:key']
-            self.stamp  = resp_dict['s:Envelope']['s:Body']['UploadTokenResponse']['UploadTokenResult']['a:stamp']
-            self.server = resp_dict['s:Envelope']['s:Body']['UploadTokenResponse']['UploadTokenResult']['a:server']
-            self.locale = resp_dict['s:Envelope']['s:Body']['UploadTokenResponse']['UploadTokenResult']['a:locale']
-            self.server, _, self.port = self.server.partition(":")
-            return self.token, self.stamp, self.server, self.port
+            token  = resp_dict['s:Envelope']['s:Body']['UploadTokenResponse']['UploadTokenResult']['a:key']
+            stamp  = resp_dict['s:Envelope']['s:Body']['UploadTokenResponse']['UploadTokenResult']['a:stamp']
+            server = resp_dict['s:Envelope']['s:Body']['UploadTokenResponse']['UploadTokenResult']['a:server']
+            server, _, port = server.partition(":")
+            return token, stamp, server, port
         except IndexError, e:
             self.view.print_( "Blad(pobieranie informacji z chomika):", e )
             self.view.print_( resp )
@@ -572,7 +796,7 @@ class Chomik(object):
                 
 
         
-    def __upload(self, filepath, filename, token, stamp, server, port):
+    def __upload(self, filepath, filename, token, stamp, server, port, chomik_id, folder_id):
         """
         Wysylanie pliku znajdujacego sie pod 'filepath' i nazwanie go 'filename'
         #TODO: Opis i podpis
@@ -580,48 +804,11 @@ class Chomik(object):
         
         #Tworzenie naglowka
         size = os.path.getsize(filepath)
-        header, contenttail =  self.__create_header(server, port, token, stamp, filename, size)  
+        header, contenttail =  self.create_upload_header(server, port, token, stamp, filename, size, chomik_id, folder_id)  
         
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(glob_timeout)
-        ip = socket.gethostbyname_ex(server)[2][0]
-        sock.connect( ( ip , int(port) ) )
-        sock.send(header)
-        
-        f = open(filepath,'rb')
-        pb = view.ProgressBar(total=size, rate_refresh = 0.5, count = 0, name = filepath)
-        self.view.add_progress_bar(pb)
-        last_time = time.time()
-        #g = open("log_upload" + filename + ".txt", "w")
-        #time.sleep(random.random()*10)
-        #g.write(header)
-        #g.close()
-        try:
-            while True:
-                chunk = f.read(1024)
-                if not chunk:
-                    break
-                #g.write(chunk)
-                #self.view.print_( 'Sending Chunk: ' + str(len(chunk)) )
-                sock.send(chunk)
-                #self.view.print_( 'Chunk sent' )
-                pb.update(len(chunk))
-                #self.view.print_( 'Updating progressbar' )
-                now = time.time()
-                if now - last_time > 0.5:
-                    self.view.update_progress_bars()
-                    last_time = now
-            f.close()        
-            #self.view.print_( 'Sending tail' )
-            sock.send(contenttail)
-        except Exception, e:
-        	if self.debug:
-        	    trbck = sys.exc_info()[2]
-        	    debug_fun(trbck)
-        	raise e
-        finally:
-            self.view.update_progress_bars()
-            self.view.delete_progress_bar(pb)
+        sock = resolver.connect(server, int(port), glob_timeout)
+        sock.sendall(header)
+        self.__send_file(sock, filepath, 0, size, contenttail)
         
         resp = ""
         while True:
@@ -629,6 +816,14 @@ class Chomik(object):
             resp   += tmp
             if tmp ==  '' or "/>" in resp:
                 break
+        return self.upload_result(resp)
+    
+    
+    
+    def upload_result(self, resp):
+        """
+        Sprawdza odpowiedz serwera, na ktory wyslano plik
+        """
         if '<resp res="1" fileid=' in resp:
             return True
         else:
@@ -641,14 +836,38 @@ class Chomik(object):
             return False
     
     
+    def __send_file(self, sock, filepath, offset, size, contenttail):
+        """
+        Wysylanie zawartosci pliku (od bajtu offset) i zakonczenia zapytania.
+        Postep aktualizowany jest co blok (transfer.block_size), a nie co kilobajt.
+        """
+        pb = view.ProgressBar(total=size, rate_refresh = 0.5, count = offset, name = filepath)
+        self.view.add_progress_bar(pb)
+        def progress(count):
+            pb.update(count)
+            self.view.update_progress_bars()
+        f = open(filepath,'rb')
+        try:
+            transfer.send_file(sock, f, offset, size - offset, progress)
+            sock.sendall(contenttail)
+        except Exception, e:
+            if self.debug:
+                trbck = sys.exc_info()[2]
+                debug_fun(trbck)
+            raise e
+        finally:
+            f.close()
+            self.view.update_progress_bars()
+            self.view.delete_progress_bar(pb)
     
-    def __create_header(self, server, port, token, stamp, filename, size, resume_from = 0):
+    
+    def create_upload_header(self, server, port, token, stamp, filename, size, chomik_id, folder_id, resume_from = 0):
         #FIXME: - cos krotki ten boundary
         #boundary = "--!CHB" + str(int(time.time()))
         boundary = "--!CHB" + stamp
         
-        contentheader = boundary + '\r\nname="chomik_id"\r\nContent-Type: text/plain\r\n\r\n{0}\r\n'.format(self.chomik_id)
-        contentheader += boundary + '\r\nname="folder_id"\r\nContent-Type: text/plain\r\n\r\n{0}\r\n'.format(self.folder_id)
+        contentheader = boundary + '\r\nname="chomik_id"\r\nContent-Type: text/plain\r\n\r\n{0}\r\n'.format(chomik_id)
+        contentheader += boundary + '\r\nname="folder_id"\r\nContent-Type: text/plain\r\n\r\n{0}\r\n'.format(folder_id)
         contentheader += boundary + '\r\nname="key"\r\nContent-Type: text/plain\r\n\r\n{0}\r\n'.format(token)
         contentheader += boundary + '\r\nname="time"\r\nContent-Type: text/plain\r\n\r\n{0}\r\n'.format(stamp)
         if resume_from > 0:
@@ -674,12 +893,13 @@ class Chomik(object):
     
 #####################################################    
     def resume(self, filepath, filename, folder_id, chomik_id, token, server, port, stamp):
+        if token == None:
+            #token nie zostal pobrany - nie ma czego wznawiac
+            return False
         self.relogin()
-        self.chomik_id = chomik_id
-        self.folder_id = folder_id
         filename_tmp   = change_coding(filename)        
         filesize_sent = self.__resume_get_tokens(filepath, filename, token, server, port)
-        if (filesize_sent == -1) or token == None:
+        if filesize_sent == -1:
             if self.debug:
                 self.view.print_( "Resume ", filename_tmp )
                 self.view.print_( "Filesize sent", filesize_sent )
@@ -689,7 +909,7 @@ class Chomik(object):
     
     def __resume_with_resume_option(self, filepath, filename, token, server, port, stamp, filesize_sent, chomik_id, folder_id):
         try:
-            result = self.__resume(filepath, filename, token, server, port, stamp, filesize_sent)
+            result = self.__resume(filepath, filename, token, server, port, stamp, filesize_sent, chomik_id, folder_id)
             self.view.print_( "Result", result )
         except (socket.error, socket.timeout), e:
             self.view.print_("Wznawianie\n")
@@ -703,10 +923,7 @@ class Chomik(object):
         """
         #Pobieranie informacji o serwerze
         filename_len = len(filename)
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(glob_timeout)
-        ip = socket.gethostbyname_ex(server)[2][0]
-        sock.connect( (ip, int(port) ) )
+        sock = resolver.connect(server, int(port), glob_timeout)
         tmp = """GET /resume/check/?key={0}& HTTP/1.1\r\nConnection: close\r\nUser-Agent: ChomikBox\r\nHost: {1}:{2}\r\n\r\n""".format(token, server, port)
         sock.send( tmp )
         #Odbieranie odpowiedzi
@@ -728,49 +945,17 @@ class Chomik(object):
         
 
 
-    def __resume(self, filepath, filename, token, server, port, stamp, filesize_sent):
+    def __resume(self, filepath, filename, token, server, port, stamp, filesize_sent, chomik_id, folder_id):
         """
         Wznawianie uploadowania pliku filepath o nazwie filename o danych: folder_id, chomik_id, token, server, port, stamp
         """
         #Tworzenie naglowka
         size  = os.path.getsize(filepath)
-        header, contenttail =  self.__create_header(server, port, token, stamp, filename, (size - filesize_sent), resume_from = filesize_sent)  
+        header, contenttail =  self.create_upload_header(server, port, token, stamp, filename, (size - filesize_sent), chomik_id, folder_id, resume_from = filesize_sent)  
         
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(glob_timeout)
-        ip = socket.gethostbyname_ex(server)[2][0]
-        sock.connect( (ip,int(port) ) )
-        sock.send(header)
-        
-        f = open(filepath,'rb')
-        f.seek(filesize_sent)
-        pb = view.ProgressBar(total=size, rate_refresh = 0.5, count = filesize_sent, name = filepath)
-        self.view.add_progress_bar(pb)
-        last_time = time.time()
-        #g = open("log_resume" + filename + ".txt", "w")
-        #g.write(header)
-        #g.close()
-        try:
-            while True:
-                chunk = f.read(1024)
-                if not chunk:
-                    break
-                sock.send(chunk)
-                pb.update(len(chunk))
-                now = time.time()
-                if now - last_time > 0.5:
-                    self.view.update_progress_bars()
-                    last_time = now
-            f.close()        
-            sock.send(contenttail)
-        except Exception, e:
-            if self.debug:
-                trbck = sys.exc_info()[2]
-                debug_fun(trbck)
-            raise e
-        finally:
-            self.view.update_progress_bars()
-            self.view.delete_progress_bar(pb)
+        sock = resolver.connect(server, int(port), glob_timeout)
+        sock.sendall(header)
+        self.__send_file(sock, filepath, filesize_sent, size, contenttail)
         
         resp = ""
         while True:
@@ -778,16 +963,7 @@ class Chomik(object):
             resp   += tmp
             if tmp ==  '' or "/>" in resp:
                 break
-        if '<resp res="1" fileid=' in resp:
-            return True
-        else:
-            try:
-                error_msg = re.findall('errorMessage="([^"]*)"',resp)[0]
-                self.view.print_( "BLAD(nieudane wysylanie):\r\n",error_msg )
-            except IndexError:
-                pass
-            self.view.print_( resp )
-            return False
+        return self.upload_result(resp)
         
         
 #####################################################
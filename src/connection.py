@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Adam (adam_gr [at] gazeta.pl)
+#
+# Released under: GNU GENERAL PUBLIC LICENSE
+#
+# Ver: 0.5
+
+import socket
+import select
+import threading
+import time
+import resolver
+
+
+class ConnectionPool(object):
+    """
+    Pula trwalych polaczen (HTTP/1.1 keep-alive) do jednego hosta.
+    Polaczenia nieuzywane dluzej niz idle_timeout sekund sa zamykane.
+    """
+    def __init__(self, host, port, timeout = 20, max_idle = 8, idle_timeout = 60):
+        self.host         = host
+        self.port         = port
+        self.timeout      = timeout
+        self.max_idle     = max_idle
+        self.idle_timeout = idle_timeout
+        self.lock         = threading.Lock()
+        #lista par (gniazdo, czas ostatniego uzycia)
+        self.idle         = []
+        self.hits         = 0
+        self.misses       = 0
+        self.reconnects   = 0
+        self.evicted      = 0
+
+    def _connect(self):
+        return resolver.connect(self.host, self.port, self.timeout)
+
+    def _is_stale(self, sock, last_used, now):
+        """
+        Gniazdo jest nieaktualne, jezeli za dlugo lezalo w puli lub serwer
+        cos do niego wyslal (zazwyczaj jest to zamkniecie polaczenia).
+        """
+        if now - last_used > self.idle_timeout:
+            return True
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (select.error, socket.error, ValueError):
+            return True
+        return readable != []
+
+    def acquire(self):
+        """
+        Zwraca pare (gniazdo, reused), gdzie reused == True oznacza,
+        ze gniazdo zostalo wziete z puli.
+        """
+        now   = time.time()
+        stale = []
+        sock  = None
+        self.lock.acquire()
+        try:
+            while self.idle:
+                s, last_used = self.idle.pop()
+                if self._is_stale(s, last_used, now):
+                    stale.append(s)
+                    self.evicted += 1
+                else:
+                    sock = s
+                    break
+            if sock is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        finally:
+            self.lock.release()
+        for s in stale:
+            self._close(s)
+        if sock is not None:
+            return sock, True
+        return self._connect(), False
+
+    def release(self, sock):
+        """
+        Oddaje gniazdo do puli (odpowiedz zostala w calosci odczytana).
+        """
+        self.lock.acquire()
+        try:
+            if len(self.idle) < self.max_idle:
+                self.idle.append( (sock, time.time()) )
+                sock = None
+        finally:
+            self.lock.release()
+        if sock is not None:
+            self._close(sock)
+
+    def discard(self, sock, reconnect = False):
+        """
+        Zamyka gniazdo, ktorego nie mozna juz uzyc ponownie.
+        """
+        if reconnect:
+            self.lock.acquire()
+            try:
+                self.reconnects += 1
+            finally:
+                self.lock.release()
+        self._close(sock)
+
+    def close_all(self):
+        """
+        Zamyka wszystkie nieuzywane polaczenia (przy zakonczeniu programu)
+        """
+        self.lock.acquire()
+        try:
+            idle, self.idle = self.idle, []
+        finally:
+            self.lock.release()
+        for sock, _ in idle:
+            self._close(sock)
+
+    def stats(self):
+        """
+        Zwraca liczniki puli: trafienia, chybienia, ponowne polaczenia, usuniete
+        """
+        self.lock.acquire()
+        try:
+            return {'hits'       : self.hits,
+                    'misses'     : self.misses,
+                    'reconnects' : self.reconnects,
+                    'evicted'    : self.evicted,
+                    'idle'       : len(self.idle)}
+        finally:
+            self.lock.release()
+
+    def _close(self, sock):
+        try:
+            sock.close()
+        except socket.error:
+            pass
+
+
+#####################################################################################################
+class IncompleteResponse(socket.error):
+    """
+    Polaczenie zostalo przerwane lub odpowiedz HTTP jest niepoprawna
+    """
+    pass
+
+
+class Response(object):
+    def __init__(self, version, status, reason, headers, cookies, body):
+        self.version = version
+        self.status  = status
+        self.reason  = reason
+        #naglowki: nazwa (malymi literami) -> wartosc
+        self.headers = headers
+        self.cookies = cookies
+        self.body    = body
+
+    def keep_alive(self):
+        """
+        Czy po tej odpowiedzi polaczenie moze zostac uzyte ponownie
+        """
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.1':
+            return 'close' not in connection
+        return 'keep-alive' in connection
+
+
+class ResponseReader(object):
+    """
+    Przyrostowe odczytywanie odpowiedzi HTTP/1.1 z gniazda.
+    Koniec odpowiedzi wyznaczaja naglowki Content-Length lub
+    Transfer-Encoding: chunked, a w ich braku zamkniecie polaczenia.
+    """
+    max_line = 65536
+
+    def __init__(self, sock, chunk_size = 65536):
+        self.sock       = sock
+        self.chunk_size = chunk_size
+        #odebrane, ale jeszcze nieprzetworzone dane
+        self.buf        = ''
+        self.closed     = False
+
+    def _fill(self):
+        data = self.sock.recv(self.chunk_size)
+        if data == '':
+            self.closed = True
+            return False
+        self.buf += data
+        return True
+
+    def read_line(self):
+        start = 0
+        while True:
+            end = self.buf.find('\r\n', start)
+            if end >= 0:
+                line     = self.buf[:end]
+                self.buf = self.buf[end + 2:]
+                return line
+            if len(self.buf) > self.max_line:
+                raise IncompleteResponse('HTTP line too long')
+            #szukamy tylko w nowych danych
+            start = max(0, len(self.buf) - 1)
+            if not self._fill():
+                raise IncompleteResponse('connection closed while reading line')
+
+    def read_exact(self, size, parts):
+        """
+        Dopisuje do listy parts dokladnie size bajtow
+        """
+        if self.buf:
+            part      = self.buf[:size]
+            self.buf  = self.buf[size:]
+            size     -= len(part)
+            parts.append(part)
+        while size > 0:
+            data = self.sock.recv(min(size, self.chunk_size))
+            if data == '':
+                raise IncompleteResponse('connection closed, %d bytes missing' % size)
+            size -= len(data)
+            parts.append(data)
+
+    def read_until_close(self, parts):
+        if self.buf:
+            parts.append(self.buf)
+            self.buf = ''
+        while True:
+            data = self.sock.recv(self.chunk_size)
+            if data == '':
+                self.closed = True
+                return
+            parts.append(data)
+
+    def read_chunked(self, parts):
+        while True:
+            line = self.read_line()
+            try:
+                size = int(line.split(';', 1)[0].strip(), 16)
+            except ValueError:
+                raise IncompleteResponse('bad chunk size: %r' % line[:20])
+            if size == 0:
+                break
+            self.read_exact(size, parts)
+            if self.read_line() != '':
+                raise IncompleteResponse('missing CRLF after chunk')
+        #pomijamy ewentualne naglowki konczace (trailer)
+        while self.read_line() != '':
+            pass
+
+    def read_headers(self):
+        try:
+            status_line = self.read_line()
+        except IncompleteResponse:
+            if self.buf == '' and self.closed:
+                #serwer zamknal polaczenie, zanim cokolwiek odeslal
+                raise IncompleteResponse('connection closed before response')
+            raise
+        try:
+            version, status, reason = (status_line.split(' ', 2) + [''])[:3]
+            status = int(status)
+        except ValueError:
+            raise IncompleteResponse('bad status line: %r' % status_line[:40])
+        headers = {}
+        cookies = []
+        while True:
+            line = self.read_line()
+            if line == '':
+                break
+            name, _, value = line.partition(':')
+            name  = name.strip().lower()
+            value = value.strip()
+            if name == 'set-cookie':
+                cookies.append(value)
+            elif name in headers:
+                headers[name] += ', ' + value
+            else:
+                headers[name] = value
+        return version, status, reason, headers, cookies
+
+    def read_response(self):
+        while True:
+            version, status, reason, headers, cookies = self.read_headers()
+            #100 Continue - wlasciwa odpowiedz przychodzi pozniej
+            if status != 100:
+                break
+        parts = []
+        if status in (204, 304):
+            pass
+        elif 'chunked' in headers.get('transfer-encoding', '').lower():
+            self.read_chunked(parts)
+        elif 'content-length' in headers:
+            try:
+                length = int(headers['content-length'])
+            except ValueError:
+                raise IncompleteResponse('bad Content-Length')
+            self.read_exact(length, parts)
+        else:
+            self.read_until_close(parts)
+            headers['connection'] = 'close'
+        return Response(version, status, reason, headers, cookies, ''.join(parts))
+
+
+def read_response(sock):
+    """
+    Odczytuje z gniazda jedna odpowiedz HTTP i zwraca obiekt Response
+    """
+    return ResponseReader(sock).read_response()
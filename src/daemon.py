@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Adam (adam_gr [at] gazeta.pl)
+#
+# Released under: GNU GENERAL PUBLIC LICENSE
+#
+# Ver: 0.5
+
+import errno
+import json
+import os
+import socket
+import SocketServer
+import threading
+import traceback
+import cache
+import scheduler
+
+
+def default_socket():
+    """
+    Domyslna sciezka gniazda, na ktorym demon przyjmuje zadania
+    """
+    return cache.cache_path('daemon.sock')
+
+
+def _encode(text):
+    #sciezki przesylane sa jako utf-8 (json zwraca unicode)
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
+
+
+class Job(object):
+    """
+    Zadanie przyslane przez klienta: liczniki plikow dodanych do kolejki,
+    wyslanych i niewyslanych. Jest tez wlascicielem zajetych plikow
+    (model.Pending) - do czasu wyslania wszystkich plikow z kolejki.
+    """
+    def __init__(self):
+        self.cond     = threading.Condition()
+        self.queued   = 0
+        self.uploaded = 0
+        self.failed   = 0
+        #wszystkie pliki zadania sa juz w kolejce
+        self.closed   = False
+
+    def add(self):
+        self.cond.acquire()
+        try:
+            self.queued += 1
+        finally:
+            self.cond.release()
+
+    def finished(self, result):
+        self.cond.acquire()
+        try:
+            if result:
+                self.uploaded += 1
+            else:
+                self.failed += 1
+            self.cond.notify_all()
+        finally:
+            self.cond.release()
+
+    def close(self):
+        self.cond.acquire()
+        try:
+            self.closed = True
+            self.cond.notify_all()
+        finally:
+            self.cond.release()
+
+    def is_alive(self):
+        self.cond.acquire()
+        try:
+            return not self.closed or self.uploaded + self.failed < self.queued
+        finally:
+            self.cond.release()
+
+    def wait(self):
+        self.cond.acquire()
+        try:
+            while not self.closed or self.uploaded + self.failed < self.queued:
+                #czekanie z timeoutem, zeby Ctrl+C przerywal program
+                self.cond.wait(1.)
+        finally:
+            self.cond.release()
+
+
+class _Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class _Handler(SocketServer.StreamRequestHandler):
+    """
+    Obsluga polaczenia klienta: zapytania i odpowiedzi to obiekty json,
+    po jednym w linii
+    """
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+            except ValueError:
+                self.reply( {'status' : 'error', 'message' : 'niepoprawne zapytanie'} )
+                continue
+            self.server.owner.handle(request, self.reply)
+
+    def reply(self, response):
+        self.wfile.write(json.dumps(response) + '\n')
+        self.wfile.flush()
+
+
+class Daemon(object):
+    """
+    Demon: jedno zalogowane polaczenie z chomikiem i jedna pula watkow
+    wysylajacych pliki, do ktorej trafiaja zadania przysylane przez gniazdo
+    unixowe (klient: submit). Zadania dziela miedzy soba watki i limit
+    predkosci (ratelimit.limiter).
+    n - liczba watkow (None - dobierana automatycznie)
+    """
+    def __init__(self, uploader_, path, n = None):
+        self.uploader   = uploader_
+        self.view       = uploader_.view
+        self.path       = path
+        self.controller = None
+        if n == None:
+            self.controller = scheduler.Controller(uploader_.user)
+            n = self.controller.limit
+        self.n          = n
+        #krotka kolejka - tokeny pobrane z wyprzedzeniem (prefetch) nie zdaza wygasnac
+        self.sched      = scheduler.Scheduler(self.__handler_factory, n, queue_size = n, controller = self.controller)
+        self.server     = None
+        self.lock       = threading.Lock()
+        self.jobs       = 0
+
+    def __handler_factory(self):
+        upload_item = self.uploader.worker().upload_item
+        def handle(entry):
+            job, item = entry
+            result = False
+            try:
+                result = upload_item(item)
+            finally:
+                job.finished(result)
+            return result
+        return handle
+
+    def serve(self):
+        """
+        Przyjmuje zadania az do otrzymania polecenia 'quit'
+        """
+        self.__remove_stale_socket()
+        old_umask = os.umask(0077)
+        try:
+            self.server = _Server(self.path, _Handler)
+        finally:
+            os.umask(old_umask)
+        self.server.owner = self
+        self.view.print_( 'Wznawianie nieudanych transferow' )
+        self.uploader.resume()
+        self.view.print_( 'Zakonczono probe wznawiania transferow\r\n' )
+        self.sched.start()
+        self.view.print_( 'Demon oczekuje na zadania:', self.path )
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.sched.close()
+            self.sched.join()
+            self.uploader.resume()
+            self.uploader.print_stats()
+
+    def __remove_stale_socket(self):
+        if not os.path.exists(self.path):
+            return
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            try:
+                sock.connect(self.path)
+            except socket.error, e:
+                if e.args[0] not in (errno.ECONNREFUSED, errno.ENOENT):
+                    raise
+                #gniazdo po demonie, ktory nie zakonczyl sie poprawnie
+                os.remove(self.path)
+            else:
+                raise socket.error(errno.EADDRINUSE, 'Demon juz dziala: %s' % self.path)
+        finally:
+            sock.close()
+
+    def handle(self, request, reply):
+        cmd = request.get('cmd')
+        try:
+            if cmd in ('recursive', 'upload'):
+                self.submit(cmd, _encode(request.get('chomik_path', '')), _encode(request.get('path', '')), request.get('wait', True), reply)
+            elif cmd == 'status':
+                reply( {'status' : 'ok', 'jobs' : self.jobs, 'queued' : self.sched.queue.qsize(), 'workers' : len(self.sched.workers)} )
+            elif cmd == 'quit':
+                reply( {'status' : 'ok'} )
+                #shutdown czeka na zakonczenie serve_forever - w osobnym watku
+                thread = threading.Thread(target = self.server.shutdown)
+                thread.daemon = True
+                thread.start()
+            else:
+                reply( {'status' : 'error', 'message' : 'nieznane polecenie: %s' % cmd} )
+        except Exception, e:
+            if self.uploader.debug:
+                traceback.print_exc()
+            reply( {'status' : 'error', 'message' : str(e)} )
+
+    def submit(self, cmd, chomik_path, path, wait, reply):
+        """
+        Dodaje do wspolnej kolejki plik (cmd == 'upload') lub drzewo
+        katalogow (cmd == 'recursive')
+        """
+        if not os.path.isabs(path) or not os.path.exists(path):
+            reply( {'status' : 'error', 'message' : 'nie ma takiego pliku: %s' % path} )
+            return
+        self.lock.acquire()
+        try:
+            self.jobs += 1
+        finally:
+            self.lock.release()
+        job = Job()
+        try:
+            if cmd == 'upload':
+                folder_id = self.uploader.chomik.resolve(chomik_path)
+                items     = None
+                if folder_id != None:
+                    items = [ (path, folder_id) ]
+            else:
+                items = self.uploader.dir_items(chomik_path, path, min(self.n, 8), self.n, job)
+            if items == None:
+                reply( {'status' : 'error', 'message' : 'nie udalo sie zmienic katalogu w chomiku: %s' % chomik_path} )
+                return
+            for item in items:
+                job.add()
+                self.sched.put( (job, item) )
+            job.close()
+            reply( {'status' : 'queued', 'files' : job.queued} )
+            if wait:
+                job.wait()
+                reply( {'status' : 'done', 'uploaded' : job.uploaded, 'failed' : job.failed} )
+        finally:
+            job.close()
+            self.lock.acquire()
+            try:
+                self.jobs -= 1
+            finally:
+                self.lock.release()
+
+
+#####################################################################################################
+def submit(path, request):
+    """
+    Wysyla zadanie do demona (gniazdo path) i wypisuje jego odpowiedzi.
+    Zwraca True, gdy zadanie zakonczylo sie bez bledow
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        sock.sendall(json.dumps(request) + '\n')
+        sock.shutdown(socket.SHUT_WR)
+        f  = sock.makefile('rb')
+        ok = False
+        for line in f:
+            response = json.loads(line)
+            status   = response.get('status')
+            if status == 'error':
+                print 'Blad:', _encode(response.get('message'))
+                return False
+            elif status == 'queued':
+                print 'Dodano do kolejki plikow:', response['files']
+                ok = True
+            elif status == 'done':
+                print 'Wyslano plikow:', response['uploaded'], 'nie wyslano:', response['failed']
+                ok = response['failed'] == 0
+            else:
+                print ' '.join( '%s: %s' % (key, _encode(value)) for key, value in sorted(response.items()) )
+                ok = status == 'ok'
+        return ok
+    finally:
+        sock.close()
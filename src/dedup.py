@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Adam (adam_gr [at] gazeta.pl)
+#
+# Released under: GNU GENERAL PUBLIC LICENSE
+#
+# Ver: 0.5
+
+import hashlib
+import Queue
+import threading
+import cache
+import journal
+import model
+import scheduler
+import transfer
+
+#liczba watkow liczacych skroty plikow
+hash_threads = 2
+
+
+def file_hash(filepath):
+    """
+    Zwraca klucz zawartosci pliku: skrot sha1 i rozmiar
+    """
+    h    = hashlib.sha1()
+    size = 0
+    f    = open(filepath, 'rb')
+    try:
+        while True:
+            data = f.read(transfer.block_size)
+            if not data:
+                break
+            h.update(data)
+            size += len(data)
+    finally:
+        f.close()
+    return '%s:%d' % (h.hexdigest(), size)
+
+
+class HashIndex(object):
+    """
+    Pliki wyslane na chomika: klucz zawartosci -> (id katalogu, nazwa pliku).
+    Wpisy dopisywane sa na koncu pliku path.
+    """
+    def __init__(self, path):
+        self.lock    = threading.Lock()
+        self.path    = path
+        self.entries = {}
+        try:
+            f = open(self.path, 'rb')
+        except IOError:
+            f = None
+        if f != None:
+            try:
+                for line in f:
+                    fields = [ journal.unescape_field(i) for i in line.rstrip('\r\n').split('\t') ]
+                    if len(fields) == 3:
+                        self.entries[fields[0]] = (fields[1], fields[2])
+            finally:
+                f.close()
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def add(self, key, folder_id, filename):
+        self.lock.acquire()
+        try:
+            if self.entries.get(key) == (folder_id, filename):
+                return
+            self.entries[key] = (folder_id, filename)
+            f = open(self.path, 'ab')
+            try:
+                f.write('\t'.join([ journal.escape_field(str(i)) for i in (key, folder_id, filename) ]) + '\n')
+            finally:
+                f.close()
+        finally:
+            self.lock.release()
+
+
+class _Batch(object):
+    """
+    Stan jednego wywolania Dedup.filter: kolejka wynikow i liczba plikow
+    czekajacych na zakonczenie wysylania pliku o tej samej zawartosci
+    """
+    def __init__(self, model_, view_):
+        self.model   = model_
+        self.view    = view_
+        #(wynik, czy_z_puli_watkow) - wyniki z finished nie moga czekac
+        #na miejsce w kolejce, wiec liczba pozostalych jest ograniczana osobno
+        self.out     = Queue.Queue()
+        self.room    = threading.Semaphore(4 * hash_threads)
+        self.waiting = 0
+
+
+class Dedup(object):
+    """
+    Pomijanie plikow, ktorych zawartosc byla juz wyslana na chomika
+    (w tym lub w poprzednich uruchomieniach programu).
+    Skroty plikow liczone sa w osobnej puli watkow (hash_threads).
+    """
+    def __init__(self, index):
+        self.index    = index
+        self.cond     = threading.Condition()
+        #klucze plikow aktualnie wysylanych
+        self.inflight = set()
+        #klucz -> lista (element, _Batch) plikow o tej samej zawartosci
+        #co wysylany wlasnie plik
+        self.deferred = {}
+
+    def filter(self, items, model_, view_):
+        """
+        Dla kolejnych elementow (sciezka_pliku, id_katalogu) z items liczy skroty
+        i zwraca (sciezka_pliku, id_katalogu, klucz) dla plikow do wyslania.
+        Duplikaty zaznaczane sa w model_ jako wyslane.
+        Plik o tej samej zawartosci co plik wlasnie wysylany zwracany jest
+        (lub pomijany) dopiero po wywolaniu finished dla tamtego pliku -
+        generator nie blokuje przy tym wysylania plikow zwroconych wczesniej.
+        """
+        batch = _Batch(model_, view_)
+        def handler(item):
+            batch.room.acquire()
+            result = self.__check(item, batch)
+            if result != None:
+                batch.out.put( (result, True) )
+            else:
+                batch.room.release()
+        def produce():
+            sched = scheduler.Scheduler(lambda: handler, hash_threads)
+            sched.start()
+            try:
+                for item in items:
+                    sched.put(item)
+            finally:
+                sched.close()
+                sched.join()
+                batch.out.put( (None, False) )
+        producer = threading.Thread(target = produce)
+        producer.daemon = True
+        producer.start()
+        produced = False
+        while True:
+            self.cond.acquire()
+            try:
+                if produced and batch.waiting == 0 and batch.out.empty():
+                    break
+            finally:
+                self.cond.release()
+            try:
+                #czekanie z timeoutem, zeby Ctrl+C przerywal program
+                item, counted = batch.out.get(True, 1.)
+            except Queue.Empty:
+                continue
+            if counted:
+                batch.room.release()
+            if item == None:
+                produced = True
+            elif item is not _retry:
+                yield item
+
+    def __check(self, item, batch, key = None):
+        filepath, folder_id = item
+        if key == None:
+            meta = model.file_meta(filepath)
+            try:
+                key = file_hash(filepath)
+            except (IOError, OSError):
+                return (filepath, folder_id, None)
+        else:
+            meta = None
+        self.cond.acquire()
+        try:
+            remote = self.index.get(key)
+            if remote == None:
+                if key not in self.inflight:
+                    self.inflight.add(key)
+                    return (filepath, folder_id, key)
+                self.deferred.setdefault(key, []).append( (item, batch) )
+                batch.waiting += 1
+                return None
+        finally:
+            self.cond.release()
+        batch.view.print_( 'Plik', filepath, 'jest juz na chomiku (katalog %s, plik %s) - pomijanie' % remote )
+        batch.model.add_uploaded(filepath, meta)
+        batch.model.remove_from_pending(filepath)
+        return None
+
+    def finished(self, key, folder_id, filename, result):
+        """
+        Koniec wysylania pliku o kluczu key (result == True, gdy sie udalo)
+        """
+        if key == None:
+            return
+        if result:
+            self.index.add(key, folder_id, filename)
+        self.cond.acquire()
+        try:
+            self.inflight.discard(key)
+            waiting = self.deferred.pop(key, [])
+        finally:
+            self.cond.release()
+        #pliki o tej samej zawartosci: pomijane, gdy wysylanie sie udalo,
+        #a w przeciwnym razie pierwszy z nich jest wysylany
+        for item, batch in waiting:
+            result = self.__check(item, batch, key)
+            #najpierw wynik, potem licznik - generator konczy sie, gdy
+            #licznik jest zerowy, a kolejka pusta
+            batch.out.put( (result or _retry, False) )
+            self.cond.acquire()
+            try:
+                batch.waiting -= 1
+            finally:
+                self.cond.release()
+
+
+#pusty wynik - budzi generator filter, zeby sprawdzil, czy to juz koniec
+_retry = object()
+
+
+#####################################################################################################
+#wspolne dla wszystkich watkow indeksy (po jednym na konto)
+_dedups      = {}
+_dedups_lock = threading.Lock()
+
+def shared_dedup(user):
+    _dedups_lock.acquire()
+    try:
+        d = _dedups.get(user)
+        if d == None:
+            d = Dedup(HashIndex(cache.cache_path('hashes.txt', user)))
+            _dedups[user] = d
+        return d
+    finally:
+        _dedups_lock.release()
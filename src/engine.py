@@ -0,0 +1,573 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Adam (adam_gr [at] gazeta.pl)
+#
+# Released under: GNU GENERAL PUBLIC LICENSE
+#
+# Ver: 0.5
+
+import errno
+import os
+import Queue
+import select
+import socket
+import threading
+import time
+import traceback
+import model
+import view
+import ratelimit
+import resolver
+from chomikbox import login_ip, login_port, glob_timeout
+from connection import ResponseReader, IncompleteResponse
+
+#rozmiar bloku czytanego z pliku i wysylanego do gniazda
+chunk_size = 256 * 1024
+#domyslna liczba jednoczesnie wysylanych plikow
+default_limit = 50
+#ile razy ponawiane jest pobranie tokenu (po ponownym zalogowaniu
+#lub odswiezeniu indeksu katalogow)
+max_retries   = 2
+
+
+def wake_pair():
+    """
+    Para polaczonych, nieblokujacych gniazd (odczyt, zapis) do budzenia
+    select z innych watkow. Na Windows select obsluguje tylko gniazda,
+    a socket.socketpair nie istnieje - wtedy polaczenie przez localhost.
+    """
+    if hasattr(socket, 'socketpair'):
+        r, w = socket.socketpair()
+    else:
+        srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            srv.bind( ('127.0.0.1', 0) )
+            srv.listen(1)
+            w = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            w.connect(srv.getsockname())
+            r, _ = srv.accept()
+        finally:
+            srv.close()
+    r.setblocking(0)
+    w.setblocking(0)
+    return r, w
+
+
+class _NeedMore(Exception):
+    pass
+
+
+class _BufferSocket(object):
+    """
+    Odczyt z bufora zamiast z gniazda (do parsowania odpowiedzi HTTP
+    odebranej czesciowo przez nieblokujace gniazdo)
+    """
+    def __init__(self, data, closed):
+        self.data   = data
+        self.closed = closed
+
+    def recv(self, size):
+        if self.data == '':
+            if self.closed:
+                return ''
+            raise _NeedMore()
+        data, self.data = self.data[:size], self.data[size:]
+        return data
+
+
+def parse_response(data, closed):
+    """
+    Zwraca (connection.Response, reszta danych) lub None, gdy w data nie ma jeszcze
+    calej odpowiedzi HTTP (closed == True oznacza, ze serwer zamknal polaczenie)
+    """
+    sock   = _BufferSocket(data, closed)
+    reader = ResponseReader(sock)
+    try:
+        resp = reader.read_response()
+    except _NeedMore:
+        return None
+    return resp, reader.buf + sock.data
+
+
+class Connection(object):
+    """
+    Nieblokujace polaczenie TCP z buforem danych do wyslania
+    """
+    def __init__(self, addr, timeout, host = None):
+        self.addr    = addr
+        #nazwa hosta (do zgloszenia nieudanego polaczenia do resolver)
+        self.host    = host
+        self.sock    = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setblocking(0)
+        self.timeout = timeout
+        self.out     = ''
+        self.inp     = ''
+        self.closed  = False
+        self.ready   = False
+        self.touch()
+        err = self.sock.connect_ex(addr)
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+            raise socket.error(err, os.strerror(err))
+
+    def touch(self):
+        self.last_activity = time.time()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def timed_out(self, now):
+        return now - self.last_activity > self.timeout
+
+    def handle_connect(self):
+        err = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err != 0:
+            raise socket.error(err, os.strerror(err))
+        self.ready = True
+
+    def write(self):
+        """
+        Wysyla dane z bufora; zwraca liczbe wyslanych bajtow
+        """
+        if not self.ready:
+            self.handle_connect()
+        if self.out == '':
+            return 0
+        try:
+            n = self.sock.send(self.out)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return 0
+            raise
+        self.out = self.out[n:]
+        self.touch()
+        return n
+
+    def read(self):
+        try:
+            data = self.sock.recv(65536)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        if data == '':
+            self.closed = True
+        self.inp += data
+        self.touch()
+
+    def is_stale(self):
+        """
+        Czy nieuzywane polaczenie zostalo zamkniete przez serwer
+        """
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+        except (select.error, socket.error, ValueError):
+            return True
+        return readable != []
+
+    def close(self):
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+
+
+#####################################################################################################
+class Job(object):
+    """
+    Wysylanie jednego pliku: pobranie tokenu (UploadToken), polaczenie
+    z serwerem plikow, wyslanie pliku i odczytanie odpowiedzi
+    """
+    #WAIT - czeka na wynik Engine.background (logowanie lub ustalenie katalogu)
+    TOKEN, SEND, RESPONSE, DONE, WAIT = range(5)
+
+    def __init__(self, engine, item):
+        self.engine    = engine
+        self.item      = item
+        self.filepath  = item[0]
+        self.folder_id = item[1]
+        self.filename  = os.path.basename(self.filepath)
+        self.state     = self.TOKEN
+        self.conn      = None
+        self.reused    = False
+        self.f         = None
+        self.pb        = None
+        self.result    = False
+        self.retries   = 0
+        #przy ograniczeniu predkosci: czas, do ktorego wstrzymane jest wysylanie
+        self.wait_until = 0
+
+    def start(self):
+        engine = self.engine
+        engine.model.add_to_pending(self.filepath)
+        #stan pliku sprzed wysylania - jezeli plik zmieni sie w trakcie, to zostanie wyslany ponownie
+        self.meta = model.file_meta(self.filepath)
+        engine.view.print_( 'Uploadowanie pliku:', self.filepath )
+        engine.model.add_notuploaded_normal(self.filepath)
+        if engine.chomik.session_ready():
+            engine.chomik.relogin()
+            self.request_token()
+        else:
+            #logowanie (Auth) blokuje - w osobnym watku, zeby nie wstrzymywac
+            #pozostalych transferow
+            self.state = self.WAIT
+            engine.background(self, engine.chomik.relogin, self.logged_in)
+
+    def logged_in(self, result):
+        """
+        Wynik Chomik.relogin wykonanego przez Engine.background
+        """
+        if not result:
+            self.engine.view.print_( 'Blad. Nie udalo sie zalogowac' )
+            self.finish(False)
+            return
+        self.state = self.TOKEN
+        self.request_token()
+
+    def request_token(self):
+        self.conn, self.reused = self.engine.soap_connection()
+        self.conn.out = self.engine.chomik.upload_token_request(self.filename, self.folder_id)
+
+    def wants_read(self):
+        return self.state in (self.TOKEN, self.RESPONSE) and self.conn.ready
+
+    def wants_write(self):
+        if not self.conn.ready:
+            return True
+        if self.wait_until > time.time():
+            return False
+        return self.state == self.SEND or self.conn.out != ''
+
+    def handle_write(self):
+        self.conn.write()
+        if self.state == self.SEND and self.conn.out == '':
+            self.fill()
+
+    def fill(self):
+        """
+        Dopisuje do bufora kolejny blok pliku (a na koncu zakonczenie zapytania)
+        """
+        limiter = ratelimit.limiter
+        size    = chunk_size
+        if limiter.limited():
+            size = min(chunk_size, limiter.quantum())
+        data = self.f.read(size)
+        if data:
+            delay = limiter.reserve(len(data))
+            if delay > 0:
+                self.wait_until = time.time() + delay
+                #czekanie na przydzial nie jest bezczynnoscia polaczenia
+                self.conn.last_activity += delay
+            self.conn.out = data
+            self.pb.update(len(data))
+            self.engine.view.update_progress_bars()
+        else:
+            self.conn.out = self.contenttail
+            self.state    = self.RESPONSE
+            self.close_file()
+
+    def handle_read(self):
+        self.conn.read()
+        if self.state == self.TOKEN:
+            self.read_token()
+        elif self.state == self.RESPONSE:
+            if self.conn.closed or "/>" in self.conn.inp:
+                resp = self.conn.inp
+                self.conn.close()
+                self.finish(self.engine.chomik.upload_result(resp))
+
+    def read_token(self):
+        engine = self.engine
+        parsed = parse_response(self.conn.inp, self.conn.closed)
+        if parsed == None:
+            if self.conn.closed:
+                raise IncompleteResponse('connection closed')
+            return
+        resp, rest = parsed
+        engine.release_soap_connection(self.conn, resp.keep_alive() and rest == '')
+        self.conn = None
+        token, stamp, server, port = engine.chomik.parse_upload_token(engine.chomik.response_body(resp))
+        if token == None:
+            if self.retries < max_retries:
+                #np. odrzucona sesja lub katalog usuniety z chomika - sprawdzane
+                #w osobnym watku, zeby nie wstrzymywac pozostalych transferow
+                self.retries += 1
+                self.state    = self.WAIT
+                engine.background(self, lambda: engine.chomik.upload_retry_folder(self.folder_id), self.retry)
+            else:
+                self.finish(False)
+            return
+        chomik_id = engine.chomik.chomik_id
+        engine.model.add_notuploaded_resume(self.filepath, self.filename, self.folder_id, chomik_id, token, server, port, stamp)
+        size = os.path.getsize(self.filepath)
+        header, self.contenttail = engine.chomik.create_upload_header(server, port, token, stamp, self.filename, size, chomik_id, self.folder_id)
+        self.f    = open(self.filepath, 'rb')
+        self.pb   = view.ProgressBar(total = size, rate_refresh = 0.5, count = 0, name = self.filepath)
+        engine.view.add_progress_bar(self.pb)
+        self.conn = Connection( (engine.resolve(server), int(port)), engine.timeout, server )
+        self.conn.out = header
+        self.state    = self.SEND
+
+    def retry(self, folder_id):
+        """
+        Ponowne pobranie tokenu (folder_id - id katalogu ustalone przez
+        Chomik.upload_retry_folder lub None, gdy ponawianie nie ma sensu
+        albo sprawdzanie sie nie udalo)
+        """
+        if folder_id == None:
+            self.finish(False)
+            return
+        self.engine.view.print_( 'Ponowna proba wysylania pliku:', self.filepath )
+        self.folder_id = folder_id
+        self.state     = self.TOKEN
+        self.request_token()
+
+    def handle_error(self, e):
+        if self.state == self.TOKEN and self.reused and self.conn != None:
+            #polaczenie z puli moglo zostac zamkniete przez serwer
+            self.conn.close()
+            self.conn = None
+            try:
+                self.request_token()
+                return
+            except Exception, e:
+                pass
+        if self.conn != None:
+            if not self.conn.ready and self.conn.host != None:
+                #nastepne polaczenie z tym hostem uzyje innego adresu
+                resolver.resolver.failed(self.conn.host, self.conn.addr[0])
+            self.conn.close()
+        self.engine.view.print_( 'Blad:', e )
+        if self.engine.debug:
+            traceback.print_exc()
+        self.finish(False)
+
+    def close_file(self):
+        if self.f != None:
+            self.f.close()
+            self.f = None
+        if self.pb != None:
+            self.engine.view.update_progress_bars()
+            self.engine.view.delete_progress_bar(self.pb)
+            self.pb = None
+
+    def finish(self, result):
+        engine      = self.engine
+        self.state  = self.DONE
+        self.result = result
+        self.close_file()
+        if result:
+            engine.model.add_uploaded(self.filepath, self.meta)
+            engine.model.remove_notuploaded(self.filepath)
+            engine.view.print_( 'Zakonczono uploadowanie\r\n' )
+        else:
+            #plik zostaje na liscie notuploaded - zostanie wznowiony pozniej
+            engine.view.print_( 'Blad. Plik ', self.filepath, ' nie zostal wyslany\r\n' )
+        engine.model.remove_from_pending(self.filepath)
+        if engine.dedup != None and len(self.item) > 2:
+            engine.dedup.finished(self.item[2], self.folder_id, self.filename, result)
+
+
+#####################################################################################################
+class Engine(object):
+    """
+    Wysylanie wielu plikow jednoczesnie w jednym watku (petla zdarzen oparta
+    na select i nieblokujacych gniazdach) zamiast osobnego watku na kazdy plik.
+    limit - maksymalna liczba jednoczesnie wysylanych plikow.
+    """
+    #maksymalna liczba nieuzywanych polaczen do uslugi SOAP
+    max_idle = 8
+
+    def __init__(self, chomik, model_, view_, limit = default_limit, timeout = glob_timeout, debug = False, dedup = None):
+        self.chomik  = chomik
+        self.model   = model_
+        self.view    = view_
+        self.limit   = limit
+        self.timeout = timeout
+        self.debug   = debug
+        self.dedup   = dedup
+        self.idle    = []
+        #gniazda budzace petle zdarzen (wake) - tworzone przez run
+        self.wake_lock = threading.Lock()
+        self.wake_w    = None
+
+    def resolve(self, host):
+        return resolver.resolve(host)[0]
+
+    def soap_connection(self):
+        """
+        Zwraca pare (polaczenie do uslugi SOAP, czy_z_puli)
+        """
+        while self.idle:
+            conn = self.idle.pop()
+            if conn.is_stale():
+                conn.close()
+            else:
+                conn.inp = ''
+                conn.touch()
+                return conn, True
+        return Connection( (self.resolve(login_ip), login_port), self.timeout, login_ip ), False
+
+    def release_soap_connection(self, conn, keep_alive):
+        if keep_alive and len(self.idle) < self.max_idle:
+            self.idle.append(conn)
+        else:
+            conn.close()
+
+    def run(self, items):
+        """
+        Wysyla pliki z items: (sciezka_pliku, id_katalogu[, klucz_zawartosci]).
+        Elementy items odczytywane sa w osobnym watku - generator (np.
+        Dedup.filter) moze czekac na zakonczenie transferow obslugiwanych
+        przez petle zdarzen.
+        """
+        #elementy z items (None - koniec)
+        self.inbox    = Queue.Queue(self.limit)
+        #(zadanie, funkcja_zwrotna, wynik) - wyniki Engine.background
+        self.results  = Queue.Queue()
+        #liczba zadan czekajacych na Engine.background
+        self.waiting  = 0
+        self.wake_r, self.wake_w = wake_pair()
+        self.stopped = threading.Event()
+        errors       = []
+        feeder = threading.Thread(target = self.__feed, args = (items, errors))
+        feeder.daemon = True
+        feeder.start()
+        active = []
+        more   = True
+        try:
+            while True:
+                while True:
+                    try:
+                        job, callback, result = self.results.get_nowait()
+                    except Queue.Empty:
+                        break
+                    self.waiting -= 1
+                    try:
+                        callback(result)
+                    except Exception, e:
+                        job.handle_error(e)
+                    if job.state not in (Job.DONE, Job.WAIT):
+                        active.append(job)
+                while more and len(active) + self.waiting < self.limit:
+                    try:
+                        item = self.inbox.get_nowait()
+                    except Queue.Empty:
+                        break
+                    if item == None:
+                        more = False
+                        break
+                    job = Job(self, item)
+                    try:
+                        job.start()
+                    except Exception, e:
+                        job.handle_error(e)
+                    if job.state not in (Job.DONE, Job.WAIT):
+                        active.append(job)
+                if not active and not more and self.waiting == 0:
+                    break
+                self.poll(active)
+                active = [ job for job in active if job.state not in (Job.DONE, Job.WAIT) ]
+        finally:
+            self.stopped.set()
+            for conn in self.idle:
+                conn.close()
+            self.idle = []
+            self.wake_lock.acquire()
+            try:
+                self.wake_r.close()
+                self.wake_w.close()
+                self.wake_w = None
+            finally:
+                self.wake_lock.release()
+        if errors:
+            raise errors[0]
+
+    def __feed(self, items, errors):
+        try:
+            try:
+                for item in items:
+                    if not self.__put(item):
+                        return
+            except Exception, e:
+                errors.append(e)
+        finally:
+            self.__put(None)
+
+    def __put(self, item):
+        #petla zdarzen mogla sie juz zakonczyc (stopped)
+        while not self.stopped.is_set():
+            try:
+                self.inbox.put(item, True, 1.)
+            except Queue.Full:
+                continue
+            self.wake()
+            return True
+        return False
+
+    def wake(self):
+        """
+        Budzi petle zdarzen (select) - wywolywane z innych watkow
+        """
+        self.wake_lock.acquire()
+        try:
+            if self.wake_w != None:
+                self.wake_w.send('x')
+        except socket.error:
+            #bufor gniazda pelny - petla i tak sie obudzi
+            pass
+        finally:
+            self.wake_lock.release()
+
+    def background(self, job, func, callback):
+        """
+        Wykonuje func() w osobnym watku (operacje blokujace, np. logowanie
+        lub ustalenie katalogu do ponowienia); callback - metoda zadania job
+        wywolywana w petli zdarzen z wynikiem func (None przy bledzie)
+        """
+        self.waiting += 1
+        def run():
+            result = None
+            try:
+                result = func()
+            except Exception:
+                if self.debug:
+                    traceback.print_exc()
+            self.results.put( (job, callback, result) )
+            self.wake()
+        thread = threading.Thread(target = run)
+        thread.daemon = True
+        thread.start()
+
+    def poll(self, active):
+        rlist = [ job.conn for job in active if job.wants_read() ] + [self.wake_r]
+        wlist = [ job.conn for job in active if job.wants_write() ]
+        timeout = 1.
+        now     = time.time()
+        waits   = [ job.wait_until for job in active if job.wait_until > now ]
+        if waits:
+            timeout = min(timeout, min(waits) - now)
+        try:
+            readable, writable, _ = select.select(rlist, wlist, [], timeout)
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return
+            raise
+        readable = set(readable)
+        writable = set(writable)
+        if self.wake_r in readable:
+            try:
+                self.wake_r.recv(4096)
+            except socket.error:
+                pass
+        now      = time.time()
+        for job in active:
+            conn = job.conn
+            try:
+                if conn in writable:
+                    job.handle_write()
+                if conn in readable and job.state != Job.DONE and job.conn is conn:
+                    job.handle_read()
+                if job.state != Job.DONE and job.conn is conn and conn.timed_out(now):
+                    raise socket.timeout('timed out')
+            except Exception, e:
+                job.handle_error(e)
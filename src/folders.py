@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Adam (adam_gr [at] gazeta.pl)
+#
+# Released under: GNU GENERAL PUBLIC LICENSE
+#
+# Ver: 0.5
+
+import atexit
+import os
+import threading
+import time
+import cache
+
+
+def unescape_name(text):
+    text = text.replace("&quot;", '"')
+    text = text.replace("&apos;", "'")
+    text = text.replace("&lt;", "<")
+    text = text.replace("&gt;", ">")
+    text = text.replace("&amp;", "&")
+    return text
+
+
+def subfolders(dom):
+    """
+    Zwraca liste wezlow FolderInfo bedacych bezposrednimi podkatalogami dom
+    """
+    folders = dom.get('folders') or {}
+    list_of_subfolders = folders.get('FolderInfo') or []
+    if type(list_of_subfolders) == dict:
+        list_of_subfolders = [list_of_subfolders]
+    return list_of_subfolders
+
+
+class FolderTree(object):
+    """
+    Indeks drzewa katalogow chomika.
+    nodes    - id katalogu -> (id rodzica, nazwa)
+    children - (id rodzica, nazwa) -> id katalogu
+    paths    - krotka nazw (pelna sciezka) -> id katalogu
+    Nazwy sa juz odkodowane (unicode, bez encji html).
+    """
+    root_id = '0'
+    #co ile sekund (najczesciej) zapisywac zmiany na dysk
+    save_interval = 30
+
+    def __init__(self, cache_file = None):
+        self.lock       = threading.RLock()
+        self.cache_file = cache_file
+        self.dirty      = False
+        self.last_save  = time.time()
+        self.clear()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.nodes    = {self.root_id : (None, u'')}
+            self.children = {}
+            self.paths    = {() : self.root_id}
+            #katalogi, ktorych poddrzewa pobrano z chomika w tym uruchomieniu
+            self.refreshed = set()
+            #katalogi, ktorych bezposrednie podkatalogi pobrano w tym uruchomieniu
+            self.listed    = set()
+            #blokady tworzenia katalogow: (id rodzica, nazwa) -> Lock
+            self.creating  = {}
+        finally:
+            self.lock.release()
+
+    def add(self, parent_id, name, folder_id):
+        self.lock.acquire()
+        try:
+            key = (parent_id, name)
+            old = self.children.get(key)
+            if old != None and old != folder_id:
+                #katalog zostal utworzony ponownie - sciezki moga byc nieaktualne
+                self.paths = {() : self.root_id}
+                self.nodes.pop(old, None)
+            self.children[key]   = folder_id
+            self.nodes[folder_id] = (parent_id, name)
+            self.dirty = True
+        finally:
+            self.lock.release()
+
+    def remove(self, folder_id):
+        """
+        Usuwa z indeksu katalog folder_id wraz z podkatalogami
+        (np. gdy okazalo sie, ze nie istnieje juz na chomiku)
+        """
+        self.lock.acquire()
+        try:
+            if folder_id == self.root_id or folder_id not in self.nodes:
+                return
+            by_parent = {}
+            for (parent_id, name), child_id in self.children.iteritems():
+                by_parent.setdefault(parent_id, []).append( (name, child_id) )
+            stack = [folder_id]
+            while stack:
+                node_id = stack.pop()
+                parent_id, name = self.nodes.pop(node_id, (None, None))
+                self.children.pop( (parent_id, name), None )
+                for name, child_id in by_parent.get(node_id, []):
+                    stack.append(child_id)
+            self.paths = {() : self.root_id}
+            self.dirty = True
+        finally:
+            self.lock.release()
+
+    def empty(self):
+        return len(self.nodes) <= 1
+
+    def mark_refreshed(self, folder_id):
+        self.refreshed.add(folder_id)
+
+    def mark_listed(self, folder_id):
+        self.listed.add(folder_id)
+
+    def is_listed(self, folder_id):
+        return folder_id in self.listed or self.is_fresh(folder_id)
+
+    def is_fresh(self, folder_id):
+        """
+        Czy katalog (lub ktorys z jego przodkow) byl pobrany z chomika
+        w tym uruchomieniu programu (a nie tylko wczytany z pliku)
+        """
+        while folder_id != None:
+            if folder_id in self.refreshed:
+                return True
+            folder_id = self.nodes.get(folder_id, (None, None))[0]
+        return False
+
+    def load_dom(self, dom, folder_id = None):
+        """
+        Dodaje do indeksu poddrzewo zwrocone przez usluge Folders
+        (wezel dom odpowiada katalogowi folder_id)
+        """
+        if folder_id == None:
+            folder_id = self.root_id
+        stack = [(dom, folder_id)]
+        self.lock.acquire()
+        try:
+            while stack:
+                node, node_id = stack.pop()
+                for sub in subfolders(node):
+                    sub_id = sub.get('id')
+                    if sub_id == None:
+                        continue
+                    self.add(node_id, unescape_name(sub.get('name', '')), sub_id)
+                    stack.append( (sub, sub_id) )
+        finally:
+            self.lock.release()
+
+    def load(self):
+        """
+        Wczytuje indeks z pliku cache_file (id, id rodzica i nazwa w kazdej linii)
+        """
+        if self.cache_file == None or not os.path.exists(self.cache_file):
+            return False
+        self.lock.acquire()
+        try:
+            f = open(self.cache_file, 'rb')
+            try:
+                for line in f:
+                    try:
+                        folder_id, parent_id, name = line.rstrip('\r\n').split('\t')
+                    except ValueError:
+                        continue
+                    self.add(parent_id, name.decode('unicode_escape'), folder_id)
+            finally:
+                f.close()
+            self.dirty     = False
+            self.last_save = time.time()
+        finally:
+            self.lock.release()
+        return True
+
+    def save(self, force = True):
+        """
+        Zapisuje indeks do pliku cache_file (gdy force == False, to
+        nie czesciej niz co save_interval sekund)
+        """
+        if self.cache_file == None or not self.dirty:
+            return
+        if not force and time.time() - self.last_save < self.save_interval:
+            return
+        self.lock.acquire()
+        try:
+            lines = []
+            for folder_id, (parent_id, name) in self.nodes.iteritems():
+                if folder_id == self.root_id:
+                    continue
+                lines.append( '%s\t%s\t%s\n' % (folder_id, parent_id, name.encode('unicode_escape')) )
+            self.dirty     = False
+            self.last_save = time.time()
+        finally:
+            self.lock.release()
+        try:
+            cache.write_atomic(self.cache_file, ''.join(lines))
+        except (IOError, OSError):
+            #zapis zostanie powtorzony przy nastepnym save
+            self.dirty = True
+            raise
+
+    def creation_lock(self, parent_id, name):
+        """
+        Blokada, ktora musi trzymac watek tworzacy katalog name w parent_id
+        """
+        self.lock.acquire()
+        try:
+            return self.creating.setdefault( (parent_id, name), threading.Lock() )
+        finally:
+            self.lock.release()
+
+    def child(self, parent_id, name):
+        return self.children.get( (parent_id, name) )
+
+    def lookup(self, names):
+        """
+        Zwraca id katalogu o sciezce names (lista nazw) lub None
+        """
+        depth, folder_id = self.longest_prefix(names)
+        if depth == len(names):
+            return folder_id
+        return None
+
+    def longest_prefix(self, names):
+        """
+        Zwraca (n, id), gdzie n to dlugosc najdluzszego istniejacego
+        poczatku sciezki names, a id to id ostatniego katalogu na tej sciezce
+        """
+        path      = tuple(names)
+        folder_id = self.paths.get(path)
+        if folder_id != None:
+            return len(path), folder_id
+        folder_id = self.root_id
+        depth     = 0
+        for name in path:
+            child_id = self.children.get( (folder_id, name) )
+            if child_id == None:
+                break
+            folder_id  = child_id
+            depth     += 1
+        if depth == len(path):
+            self.paths[path] = folder_id
+        return depth, folder_id
+
+    def path_of(self, folder_id):
+        """
+        Zwraca liste nazw od korzenia do katalogu folder_id (lub None)
+        """
+        names = []
+        while folder_id != self.root_id:
+            node = self.nodes.get(folder_id)
+            if node == None:
+                return None
+            folder_id, name = node
+            names.append(name)
+        names.reverse()
+        return names
+
+
+#####################################################################################################
+#wspolne dla wszystkich watkow indeksy katalogow (po jednym na konto)
+_trees      = {}
+_trees_lock = threading.Lock()
+
+def shared_tree(user):
+    """
+    Zwraca wspolny dla calego procesu indeks katalogow konta user,
+    wczytany z pliku, jezeli byl zapisany przy poprzednim uruchomieniu
+    """
+    _trees_lock.acquire()
+    try:
+        tree = _trees.get(user)
+        if tree == None:
+            tree = FolderTree(cache.cache_path('folders.txt', user))
+            tree.load()
+            _trees[user] = tree
+        return tree
+    finally:
+        _trees_lock.release()
+
+
+def _save_trees():
+    for tree in _trees.values():
+        try:
+            tree.save()
+        except (IOError, OSError):
+            pass
+
+atexit.register(_save_trees)
@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Adam (adam_gr [at] gazeta.pl)
+#
+# Released under: GNU GENERAL PUBLIC LICENSE
+#
+# Ver: 0.5
+
+import atexit
+import os
+import re
+import threading
+import time
+import cache
+import pathindex
+
+#Rodzaje wpisow w dzienniku (pola oddzielone tabulatorem):
+#U sciezka [rozmiar mtime inode] - plik wyslany
+#N sciezka         - plik niewyslany (bez danych do wznowienia)
+#R sciezka ...     - plik niewyslany, dane do wznowienia (jak w notuploaded.txt)
+#D sciezka         - usuniecie pliku z listy niewyslanych
+UPLOADED = 'U'
+NORMAL   = 'N'
+RESUME   = 'R'
+DELETE   = 'D'
+
+
+def escape_field(text):
+    text = text.replace('\\', '\\\\')
+    text = text.replace('\t', '\\t')
+    text = text.replace('\n', '\\n')
+    text = text.replace('\r', '\\r')
+    return text
+
+def format_field(value):
+    """
+    Pole wpisu: None zapisywane jest jako puste pole
+    """
+    if value == None:
+        return ''
+    return escape_field(str(value))
+
+def _none_field(value):
+    if value in (None, '', 'None'):
+        return None
+    return value
+
+_unescape_re = re.compile(r'\\(.)')
+_unescape    = {'t' : '\t', 'n' : '\n', 'r' : '\r', '\\' : '\\'}
+
+def unescape_field(text):
+    if '\\' not in text:
+        return text
+    return _unescape_re.sub(lambda m: _unescape.get(m.group(1), m.group(1)), text)
+
+
+class Journal(object):
+    """
+    Dziennik wyslanych i niewyslanych plikow.
+    Zmiany sa dopisywane na koncu pliku, a co jakis czas plik jest
+    przepisywany od nowa (tylko aktualne wpisy).
+    Pliki wyslane sa przy tym przenoszone do indeksu index_path (PathIndex).
+    fsync wykonywany jest co sync_every wpisow lub co sync_interval sekund.
+    Z dziennika moze korzystac kilka procesow naraz (np. uruchamianych przez
+    crona): zapis i przepisywanie pliku odbywaja sie pod blokada flock
+    (plik path.lock; bez modulu fcntl, np. na Windows, tylko blokada miedzy
+    watkami), a przed kazda zmiana wczytywane sa wpisy dopisane przez inne procesy.
+    """
+    #maksymalna liczba wyslanych plikow trzymanych w pamieci przed zapisem do indeksu
+    merge_every = 100000
+
+    def __init__(self, path, index_path = None, sync_every = 100, sync_interval = 1.0):
+        if index_path == None:
+            index_path = os.path.join(os.path.dirname(path), 'uploaded.idx')
+        self.lock               = threading.RLock()
+        self.path               = path
+        self.sync_every         = sync_every
+        self.sync_interval      = sync_interval
+        self.uploaded           = pathindex.PathIndex(index_path)
+        self.notuploaded_normal = {}
+        #sciezka -> (filepath, filename, folder_id, chomik_id, token, host, port, stamp)
+        self.notuploaded_resume = {}
+        #liczba wpisow w pliku (razem z nieaktualnymi)
+        self.records            = 0
+        self.unsynced           = 0
+        self.last_sync          = time.time()
+        self.f                  = None
+        #do ktorego miejsca plik dziennika zostal wczytany
+        self.offset             = 0
+        self.lock_fd            = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0600)
+        #liczba zagniezdzonych _acquire (flock zakladany jest raz)
+        self.depth              = 0
+        self._acquire()
+        self._release()
+
+    def _acquire(self):
+        """
+        Blokada dziennika: watkow (lock) i procesow (flock). Po jej
+        zalozeniu wczytywane sa zmiany zapisane przez inne procesy
+        """
+        self.lock.acquire()
+        if self.depth == 0 and self.lock_fd != None:
+            try:
+                cache.lock_file(self.lock_fd)
+                self._catch_up()
+            except:
+                cache.unlock_file(self.lock_fd)
+                self.lock.release()
+                raise
+        self.depth += 1
+
+    def _release(self):
+        self.depth -= 1
+        if self.depth == 0 and self.lock_fd != None:
+            cache.unlock_file(self.lock_fd)
+        self.lock.release()
+
+    def _catch_up(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            st = None
+        if self.f == None or st == None or st.st_ino != os.fstat(self.f.fileno()).st_ino:
+            #dziennik zostal przepisany (compact) przez inny proces - zawiera
+            #wszystkie aktualne wpisy, wiec niewyslane pliki wczytywane sa od nowa
+            if self.f != None:
+                self.f.close()
+            self.notuploaded_normal = {}
+            self.notuploaded_resume = {}
+            self.records            = 0
+            self.offset             = 0
+            if st != None:
+                self._replay()
+            self.f = open(self.path, 'ab')
+            #wyslane pliki z przepisanego dziennika sa juz w indeksie
+            self.uploaded.reload()
+        elif st.st_size > self.offset:
+            self._replay()
+
+    def _replay(self):
+        """
+        Wczytuje wpisy od miejsca offset do konca pliku
+        """
+        f = open(self.path, 'rb')
+        try:
+            f.seek(self.offset)
+            while True:
+                line = f.readline()
+                if not line.endswith('\n'):
+                    #koniec pliku (lub niedokonczony wpis przerwanego procesu)
+                    break
+                self.offset = f.tell()
+                line = line.rstrip('\r\n')
+                if line == '':
+                    continue
+                fields = [unescape_field(i) for i in line.split('\t')]
+                self._apply(fields)
+                self.records += 1
+        finally:
+            f.close()
+
+    def _apply(self, fields):
+        kind, filepath = fields[0], fields[1]
+        if kind == UPLOADED:
+            meta = None
+            if len(fields) == 5:
+                meta = (int(fields[2]), float(fields[3]), int(fields[4]))
+            self.uploaded.add(filepath, meta)
+        elif kind == NORMAL:
+            self.notuploaded_normal[filepath] = True
+        elif kind == RESUME and len(fields) == 9:
+            self.notuploaded_normal.pop(filepath, None)
+            #token, host, port i stamp: puste pole (brak tokenu) - None
+            #('None' - wpisy zapisane przez poprzednie wersje)
+            self.notuploaded_resume[filepath] = tuple(fields[1:5]) + tuple([ _none_field(i) for i in fields[5:] ])
+        elif kind == DELETE:
+            self.notuploaded_normal.pop(filepath, None)
+            self.notuploaded_resume.pop(filepath, None)
+
+    def _write(self, fields):
+        self._acquire()
+        try:
+            self._apply(fields)
+            line = '\t'.join([format_field(i) for i in fields]) + '\n'
+            if self.offset < os.fstat(self.f.fileno()).st_size:
+                #niedokonczony wpis przerwanego procesu - nowy wpis od nowej linii
+                line = '\n' + line
+            self.f.write(line)
+            #flush po kazdym wpisie (dane trafiaja do systemu), fsync co jakis czas
+            self.f.flush()
+            self.offset    = os.fstat(self.f.fileno()).st_size
+            self.records  += 1
+            self.unsynced += 1
+            self.sync(force = False)
+            if self.records > 2 * self.live_records() + 10000 or len(self.uploaded.delta) >= self.merge_every:
+                self.compact()
+        finally:
+            self._release()
+
+    def live_records(self):
+        return len(self.uploaded.delta) + len(self.notuploaded_normal) + len(self.notuploaded_resume)
+
+    def sync(self, force = True):
+        self.lock.acquire()
+        try:
+            if self.unsynced == 0 or self.f == None:
+                return
+            now = time.time()
+            if force or self.unsynced >= self.sync_every or now - self.last_sync > self.sync_interval:
+                self.f.flush()
+                os.fsync(self.f.fileno())
+                self.unsynced  = 0
+                self.last_sync = now
+        finally:
+            self.lock.release()
+
+    def compact(self):
+        """
+        Przepisuje dziennik, zostawiajac tylko aktualne wpisy
+        (wyslane pliki trafiaja najpierw do indeksu)
+        """
+        self._acquire()
+        try:
+            self.uploaded.merge()
+            tmp = self.path + '.tmp'
+            f   = open(tmp, 'wb')
+            try:
+                for filepath in self.notuploaded_normal:
+                    f.write('%s\t%s\n' % (NORMAL, escape_field(filepath)))
+                for record in self.notuploaded_resume.values():
+                    f.write('\t'.join([RESUME] + [format_field(i) for i in record]) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+            if self.f != None:
+                self.f.close()
+            cache.replace(tmp, self.path)
+            self.f         = open(self.path, 'ab')
+            self.offset    = os.fstat(self.f.fileno()).st_size
+            self.records   = self.live_records()
+            self.unsynced  = 0
+            self.last_sync = time.time()
+        finally:
+            self._release()
+
+    def close(self):
+        self._acquire()
+        try:
+            if self.f != None:
+                if self.uploaded.delta:
+                    self.compact()
+                self.sync()
+                self.f.close()
+                self.f = None
+            self.uploaded.close()
+            if self.lock_fd != None:
+                os.close(self.lock_fd)
+                self.lock_fd = None
+        finally:
+            self._release()
+
+    ###########################################################################
+    def add_uploaded(self, filepath, meta = None):
+        """
+        meta - (rozmiar, mtime, inode) pliku lub None
+        """
+        self._acquire()
+        try:
+            found, stored_meta = self.uploaded.lookup(filepath)
+            if meta == None:
+                if not found:
+                    self._write( (UPLOADED, filepath) )
+            elif not found or stored_meta != tuple(meta):
+                size, mtime, inode = meta
+                self._write( (UPLOADED, filepath, '%d' % size, repr(mtime), '%d' % inode) )
+        finally:
+            self._release()
+
+    def add_normal(self, filepath):
+        if filepath not in self.notuploaded_normal:
+            self._write( (NORMAL, filepath) )
+
+    def add_resume(self, filepath, filename, folder_id, chomik_id, token, host, port, stamp):
+        self._write( (RESUME, filepath, filename, folder_id, chomik_id, token, host, port, stamp) )
+
+    def remove(self, filepath):
+        if filepath in self.notuploaded_normal or filepath in self.notuploaded_resume:
+            self._write( (DELETE, filepath) )
+
+    ###########################################################################
+    def migrate(self, uploaded_file_name, notuploaded_file_name):
+        """
+        Przenosi do dziennika dane z plikow uploaded.txt i notuploaded.txt
+        (z poprzednich wersji programu). Stare pliki dostaja rozszerzenie .migrated
+        """
+        self._acquire()
+        try:
+            return self._migrate(uploaded_file_name, notuploaded_file_name)
+        finally:
+            self._release()
+
+    def _migrate(self, uploaded_file_name, notuploaded_file_name):
+        migrated = False
+        if os.path.exists(uploaded_file_name):
+            f = open(uploaded_file_name, 'rb')
+            try:
+                for line in f:
+                    line = line.strip()
+                    if line != '':
+                        self.uploaded.add(line)
+            finally:
+                f.close()
+            migrated = True
+        if os.path.exists(notuploaded_file_name):
+            f = open(notuploaded_file_name, 'rb')
+            try:
+                for line in f:
+                    line = line.strip()
+                    if line == '':
+                        continue
+                    fields = line.split('\t')
+                    if len(fields) == 8:
+                        self.notuploaded_normal.pop(fields[0], None)
+                        self.notuploaded_resume[fields[0]] = tuple(fields)
+                    else:
+                        self.notuploaded_normal[line] = True
+            finally:
+                f.close()
+            migrated = True
+        if migrated:
+            self.compact()
+            for name in (uploaded_file_name, notuploaded_file_name):
+                if os.path.exists(name):
+                    os.rename(name, name + '.migrated')
+        return migrated
+
+
+#####################################################################################################
+#wspolne dla calego procesu dzienniki (po jednym na plik)
+_journals      = {}
+_journals_lock = threading.Lock()
+
+def shared_journal(path):
+    _journals_lock.acquire()
+    try:
+        path    = os.path.abspath(path)
+        journal = _journals.get(path)
+        if journal == None:
+            journal = Journal(path)
+            _journals[path] = journal
+        return journal
+    finally:
+        _journals_lock.release()
+
+
+def _close_journals():
+    for journal in _journals.values():
+        try:
+            journal.close()
+        except (IOError, OSError):
+            pass
+
+atexit.register(_close_journals)
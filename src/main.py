@@ -10,7 +10,9 @@
 
 import uploader   
 import sys
+import os
 import getopt
+import ratelimit
 
 ######################################################################################    
 def usage():
@@ -27,11 +29,26 @@ def usage():
     print '-d, --debug\t\t wyswietala wiecej informacji przy okazji bledu programu'
     print '-t, --threads\t\t liczba watkow (ile plikow jest jednoczescnie wysylanych). Przyklad: ',
     print 'python', sys.argv[0], '-t 5 -r "/katalog1/katalog2/katalog3" "/home/nick/Dokumenty"'
+    print '\t\t\t -t auto - liczba watkow dobierana jest automatycznie na podstawie predkosci wysylania (najlepsza wartosc zapamietywana jest na nastepne uruchomienie)'
+    print '-z, --lazy\t\t nie pobiera przy logowaniu calej listy katalogow chomika, tylko podkatalogi katalogow, do ktorych wysylane sa pliki (przydatne przy bardzo duzej liczbie katalogow)'
+    print '-c, --dedup\t\t nie wysyla plikow, ktorych zawartosc zostala juz wczesniej wyslana na chomika (porownywane sa skroty sha1 plikow)'
+    print '-a, --async\t\t wysyla pliki w jednym watku, bez osobnego polaczenia i logowania dla kazdego watku (przydatne przy wielu malych plikach); -t okresla wtedy, ile plikow jest wysylanych jednoczesnie. Przyklad: ',
+    print 'python', sys.argv[0], '-a -t 100 -r "/katalog1/katalog2/katalog3" "/home/nick/Dokumenty"'
+    print '-b, --bandwidth\t\t ograniczenie lacznej predkosci wysylania (w bajtach na sekunde, np. 500k, 2M) lub harmonogram predkosci zaleznych od pory dnia. Przyklad: ',
+    print 'python', sys.argv[0], '-b "8:00-22:00=200k,22:00-8:00=2M" -t 5 -r "/katalog1/katalog2/katalog3" "/home/nick/Dokumenty"'
+    print '-w, --watch\t\t wysyla zawartosc katalogu (jak -r), a potem obserwuje go (inotify, tylko linux) i wysyla nowe pliki zaraz po ich zapisaniu, az do przerwania programu (Ctrl+C). Przyklad: ',
+    print 'python', sys.argv[0], '-w "/katalog1/katalog2/katalog3" "/home/nick/Dokumenty"'
+    print '--daemon\t\t uruchamia demona: program loguje sie raz i czeka na zadania (-r, -u) przysylane przez --submit; wszystkie zadania wysylane sa ta sama pula watkow (-t) i z tym samym ograniczeniem predkosci (-b). Przyklad: ',
+    print 'python', sys.argv[0], '-l nazwa_chomika -p haslo -t 5 --daemon'
+    print '--submit\t\t przekazuje zadanie (-r lub -u) do dzialajacego demona i czeka na jego zakonczenie (bez -r i -u - wypisuje stan demona). Przyklad: ',
+    print 'python', sys.argv[0], '--submit -r "/katalog1/katalog2/katalog3" "/home/nick/Dokumenty"'
+    print '--stop\t\t\t zatrzymuje demona (po wyslaniu plikow z kolejki)'
+    print '--socket\t\t sciezka gniazda demona (domyslnie ~/.chomikuploader/daemon.sock)'
     
 #if __name__ == '__main__':
 if True:
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'hrul:p:dt:', ['help','recursive', 'upload', 'login', 'password','debug', 'threads'])
+        opts, args = getopt.getopt(sys.argv[1:], 'hrul:p:dt:zcab:w', ['help','recursive', 'upload', 'login', 'password','debug', 'threads', 'lazy', 'dedup', 'async', 'bandwidth=', 'watch', 'daemon', 'submit', 'stop', 'socket='])
     except Exception, e:
         print 'Przekazano niepoprawny parametr'
         print e
@@ -45,6 +62,11 @@ if True:
     password = None
     threads  = 1
     debug    = False
+    lazy     = False
+    dedup    = False
+    use_async = False
+    mode     = None
+    socket_path = None
     for opt, arg in opts:
         if opt in ('-h', '--help'):
             usage()
@@ -54,21 +76,68 @@ if True:
         elif opt in ('-p', '--password'):
             password = arg
         elif opt in ('-t', '--threads'):
-            threads = int(arg)
+            if arg == 'auto':
+                threads = None
+            else:
+                threads = int(arg)
         elif opt in ('-d', '--debug'):
             debug = True
+        elif opt in ('-z', '--lazy'):
+            lazy = True
+        elif opt in ('-c', '--dedup'):
+            dedup = True
+        elif opt in ('-a', '--async'):
+            use_async = True
+        elif opt in ('-b', '--bandwidth'):
+            try:
+                ratelimit.configure(arg)
+            except ValueError, e:
+                print 'Niepoprawne ograniczenie predkosci:', arg
+                sys.exit(2)
+        elif opt in ('--daemon', '--submit', '--stop'):
+            mode = opt[2:]
+        elif opt == '--socket':
+            socket_path = arg
+    if mode != None:
+        #demon wymaga gniazd AF_UNIX (brak np. na Windows) - importowany tylko w razie potrzeby
+        try:
+            import daemon
+        except (ImportError, AttributeError):
+            print 'Tryb demona nie jest dostepny w tym systemie'
+            sys.exit(2)
+        if socket_path == None:
+            socket_path = daemon.default_socket()
+    if mode == 'daemon':
+        u = uploader.Uploader(login, password, debug = debug, lazy = lazy, dedup = dedup)
+        daemon.Daemon(u, socket_path, threads).serve()
+        sys.exit()
+    elif mode == 'stop' or (mode == 'submit' and not [opt for opt, arg in opts if opt in ('-r', '--recursive', '-u', '--upload')]):
+        cmd = {'stop' : 'quit', 'submit' : 'status'}[mode]
+        sys.exit(not daemon.submit(socket_path, {'cmd' : cmd}))
     try:
         for opt, arg in opts:
-            if opt in ('-r', '--recursive'):
+            if opt in ('-r', '--recursive', '-u', '--upload') and mode == 'submit':
+                chomik_path, path = args
+                cmd = 'recursive'
+                if opt in ('-u', '--upload'):
+                    cmd = 'upload'
+                sys.exit(not daemon.submit(socket_path, {'cmd' : cmd, 'chomik_path' : chomik_path, 'path' : os.path.abspath(path)}))
+            elif opt in ('-r', '--recursive'):
                 chomik_path, dirpath = args
-                u = uploader.Uploader(login, password, debug = debug)
-                if threads > 1:
+                u = uploader.Uploader(login, password, debug = debug, lazy = lazy, dedup = dedup)
+                if use_async:
+                    u.upload_async(chomik_path, dirpath, threads)
+                elif threads == None or threads > 1:
                     u.upload_multi(chomik_path, dirpath, threads)
                 else:
                     u.upload_dir(chomik_path, dirpath)
+            elif opt in ('-w', '--watch'):
+                chomik_path, dirpath = args
+                u = uploader.Uploader(login, password, debug = debug, lazy = lazy, dedup = dedup)
+                u.upload_watch(chomik_path, dirpath, threads)
             elif opt in ('-u', '--upload'):
                 chomik_path, filepath = args
-                u = uploader.Uploader(login, password, debug = debug)
+                u = uploader.Uploader(login, password, debug = debug, lazy = lazy)
                 u.upload_file(chomik_path, filepath)
     except ValueError, e:
         print e
@@ -9,9 +9,11 @@
 # Ver: 0.4
 import os
 import threading
-import re
+import time
 import view
 import sys
+import journal
+import pathindex
 
 
 def change_coding(text):
@@ -24,6 +26,15 @@ def change_coding(text):
         print e
     return text
 
+def file_meta(filepath):
+    """
+    Zwraca (rozmiar, mtime, inode) pliku lub None, gdy nie mozna go odczytac
+    """
+    try:
+        return pathindex.file_meta(os.stat(filepath))
+    except OSError:
+        return None
+
 def singleton(cls):
     instances = {}
     def getinstance():
@@ -33,162 +44,159 @@ def singleton(cls):
     return getinstance
 
 
+class Owner(object):
+    """
+    Wlasciciel plikow zajetych dla kolejki zadan (np. jednego wysylania
+    katalogu). Pliki w kolejce czekaja na watek wysylajacy, wiec nie moga
+    zalezec od watku, ktory je zajal (np. przegladajacego katalogi) -
+    pozostaja zajete do close(), wywolywanego po obsluzeniu kolejki.
+    """
+    def __init__(self):
+        self.closed = False
+
+    def is_alive(self):
+        return not self.closed
+
+    def close(self):
+        self.closed = True
+
+
+class Pending(object):
+    """
+    Pliki aktualnie przetwarzane: sciezka -> (wlasciciel, od kiedy); wlasciciel
+    to watek, ktory je przetwarza, albo kolejka zadan (Owner), w ktorej czekaja.
+    Wpis jest nieaktualny, gdy jego wlasciciel juz nie dziala albo (jezeli ustawiono
+    max_age) jest starszy niz max_age sekund - taki plik przejmuje watek, ktory
+    go zajmuje (claim), wiec pliki porzucone przez zakonczone watki nie sa blokowane.
+    """
+    def __init__(self, max_age = None):
+        self.lock    = threading.Lock()
+        self.entries = {}
+        self.max_age = max_age
+
+    def _is_stale(self, entry, now):
+        owner, since = entry
+        if not owner.is_alive():
+            return True
+        return self.max_age != None and now - since > self.max_age
+
+    def claim(self, filepath, owner = None):
+        """
+        Zajmuje plik dla owner (obiekt z metoda is_alive, np. Owner;
+        domyslnie biezacy watek). Zwraca False, gdy plik przetwarza juz
+        inny (dzialajacy) wlasciciel
+        """
+        now = time.time()
+        self.lock.acquire()
+        try:
+            entry = self.entries.get(filepath)
+            if entry != None and not self._is_stale(entry, now):
+                return False
+            if owner == None:
+                owner = threading.current_thread()
+            self.entries[filepath] = (owner, now)
+            return True
+        finally:
+            self.lock.release()
+
+    def take_over(self, filepath):
+        """
+        Przekazanie pliku biezacemu watkowi (np. z watku przegladajacego
+        katalogi do watku, ktory wysyla plik)
+        """
+        self.lock.acquire()
+        try:
+            self.entries[filepath] = (threading.current_thread(), time.time())
+        finally:
+            self.lock.release()
+
+    def release(self, filepath):
+        self.lock.acquire()
+        try:
+            self.entries.pop(filepath, None)
+        finally:
+            self.lock.release()
+
+    def __contains__(self, filepath):
+        return filepath in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
 #@singleton
 class Model(object):
     
     def __init__(self):
         """
-        Wczytywanie danych z plikow uploaded.txt i notuploaded.txt
+        Wczytywanie danych z dziennika journal.txt (przy pierwszym uruchomieniu
+        przenoszone sa do niego dane z plikow uploaded.txt i notuploaded.txt)
         """
         self.view                  = view.View()
         self.lock                  = threading.Lock()
-        ##synchronizacja zmiany katalogow w chomiku
-        self.chdirs_lock           = threading.Lock()
+        self.journal_file_name     = 'journal.txt'
         self.notuploaded_file_name = 'notuploaded.txt'
         self.uploaded_file_name    = 'uploaded.txt'
-        self.uploaded              = []
-        self.notuploaded           = []
-        
-        if not os.path.exists(self.uploaded_file_name):
-            open(self.uploaded_file_name, 'w').close()
-        f = open(self.uploaded_file_name, 'r')
-        self.uploaded = f.read().split('\n')
-        self.uploaded = set([i.strip() for i in self.uploaded])
-        f.close()
-        #TODO: tu stanowczo jakis test zrobic
-        if not os.path.exists(self.notuploaded_file_name):
-        	open(self.notuploaded_file_name,"w").close()
-        f     = open(self.notuploaded_file_name,"r")
-        files = [ i.strip() for i in f.readlines()]
-        f.close()
-        self.notuploaded_resume = []
-        self.notuploaded_normal = []
-        self.pending            = []
-        
-        for f in files:
-            try:
-                filepath, filename, folder_id, chomik_id, token, host, port, stamp = re.findall("([^\t]*)\t([^\t]*)\t([^\t]*)\t([^\t]*)\t([^\t]*)\t([^\t]*)\t([^\t]*)\t([^\t]*)", f)[0]
-                self.notuploaded_resume.append( (filepath, filename, folder_id, chomik_id, token, host, port, stamp) )
-            except IndexError, e:
-                self.notuploaded_normal.append( f.strip() )
-        
-    
-    def _aux_remove_notuploaded_resume(self, filepath):
-        filepath = change_coding(filepath)
-        it = 0
-        while it < len(self.notuploaded_resume):
-            i = self.notuploaded_resume[it]
-            if i[0] == filepath:
-                self.notuploaded_resume.remove(i)
-            it += 1
-            
-    def _aux_remove_notuploaded_normal(self, filepath):
-        filepath = change_coding(filepath)
-        it = 0
-        while it < len(self.notuploaded_normal):
-            i = self.notuploaded_normal[it]
-            if i == filepath:
-                self.notuploaded_normal.remove(i)
-            it += 1
-            
-    def _aux_remove_pending(self, filepath):
-        filepath = change_coding(filepath)
-        it = 0
-        while it < len(self.pending):
-            i = self.pending[it]
-            if i == filepath:
-                self.pending.remove(i)
-            it += 1
+        self.journal               = journal.shared_journal(self.journal_file_name)
+        self.journal.migrate(self.uploaded_file_name, self.notuploaded_file_name)
+        self.uploaded              = self.journal.uploaded
+        self.pending               = Pending()
     
     def add_notuploaded_normal(self, filepath):
         """
-        Dodawanie informacji o filepath na liscie notuploaded i w pliku notuploaded.txt
+        Dodawanie informacji o filepath do listy notuploaded (w dzienniku)
         """
         self.lock.acquire()
         filepath = change_coding(filepath)
         try:
-            if not filepath in self.notuploaded_normal:
-                self.notuploaded_normal.append(filepath)
-                f = open(self.notuploaded_file_name,'a')
-                f.write( filepath )
-                f.write('\r\n')
-                f.close()
+            self.journal.add_normal(filepath)
         finally:
             self.lock.release()
 
     def add_notuploaded_resume(self, filepath, filename, folder_id, chomik_id, token, host, port, stamp):
         """
-        Dodawanie informacji o filepath i danych do wznawiania na liscie notuploaded i w pliku notuploaded.txt
+        Dodawanie informacji o filepath i danych do wznawiania do listy notuploaded (w dzienniku)
         """
         self.lock.acquire()
         filepath = change_coding(filepath)
         try:
-            #FIXME:danger
-            self._aux_remove_notuploaded_resume(filepath)
-            self._aux_remove_notuploaded_normal(filepath)
-            self._save_notuploaded()
-            self.notuploaded_resume.append( (filepath, filename, folder_id, chomik_id, token, host, port, stamp) )
-            f = open(self.notuploaded_file_name,'a')
-            f.write(change_coding(filepath) + '\t')
-            f.write(change_coding(filename) + '\t')
-            f.write(str(folder_id) + '\t')
-            f.write(str(chomik_id) + '\t')
-            f.write(str(token) + '\t')
-            f.write(str(host) + '\t')
-            f.write(str(port) + '\t')
-            f.write(str(stamp))
-            f.write('\r\n')
-            f.close()
+            self.journal.add_resume(filepath, change_coding(filename), folder_id, chomik_id, token, host, port, stamp)
         finally:
             self.lock.release()
     
     def remove_notuploaded(self, filepath):
         """
-        Usuwanie filepath z listy notuploaded i z pliku notuploaded.txt
+        Usuwanie filepath z listy notuploaded
         """
         self.lock.acquire()
         filepath = change_coding(filepath)
         try:
-            #FIXME:danger
-            self._aux_remove_notuploaded_resume(filepath)
-            self._aux_remove_notuploaded_normal(filepath)
-            self._save_notuploaded()
+            self.journal.remove(filepath)
         finally:
             self.lock.release()
 
-    def _save_notuploaded(self):
-        """
-        Zapisanie do pliku nieudanych wyslan
-        """
-        f = open(self.notuploaded_file_name,'w')
-        for nu in self.notuploaded_resume:
-            l = [ str(i) for i in list(nu)]
-            f.write( change_coding('\t'.join(l)) )
-            f.write( '\r\n' )
-        for nu in self.notuploaded_normal:
-            f.write( change_coding(nu) )
-            f.write( '\r\n' )
-        f.close()
-
-        
     def get_notuploaded_resume(self):
         """
         Zwraca liste plikow, ktore mozna wznowic
         """
-        return self.notuploaded_resume
+        self.lock.acquire()
+        try:
+            return self.journal.notuploaded_resume.values()
+        finally:
+            self.lock.release()
 
 
-    def add_uploaded(self, filepath):
+    def add_uploaded(self, filepath, meta = None):
         """
-        Dodanie filepath do listy plikow poprawnie wyslanych
+        Dodanie filepath do listy plikow poprawnie wyslanych.
+        meta - (rozmiar, mtime, inode) pliku sprzed wyslania (domyslnie aktualne)
         """
+        if meta == None:
+            meta = file_meta(filepath)
         self.lock.acquire()
         filepath = change_coding(filepath)
         try:
-            self.uploaded.add(filepath)
-            f = open(self.uploaded_file_name,'a')
-            f.write(filepath + '\r\n')
-            f.close()
+            self.journal.add_uploaded(filepath, meta)
         finally:
             self.lock.release()
 
@@ -206,35 +214,33 @@ class Model(object):
         return result
     
     def add_to_pending(self, filepath):
-        pass
+        """
+        Przekazuje przetwarzanie pliku biezacemu watkowi
+        """
+        self.pending.take_over(change_coding(filepath))
     
     def remove_from_pending(self, filepath):
-        self.lock.acquire()
-        try:
-            #FIXME:danger
-            self._aux_remove_pending(filepath)
-            #self.pending = [i for i in self.pending if i != filepath]
-        finally:
-            self.lock.release()
+        self.pending.release(change_coding(filepath))
         
-    def is_uploaded_or_pended_and_add(self, filepath):
+    def is_uploaded_or_pended_and_add(self, filepath, meta = None, owner = None):
         """
-        Sprawdza, cyz plik byl juz wyslany lub, czy jest przetwarzany.
-        Jesli nie, to dodaje go do listy przetwarzanych
+        Sprawdza, cyz plik byl juz wyslany (i od tego czasu sie nie zmienil) lub,
+        czy jest przetwarzany. Jesli nie, to dodaje go do listy przetwarzanych.
+        meta - (rozmiar, mtime, inode) pliku (domyslnie pobierane przez os.stat)
+        owner - wlasciciel wpisu (Pending.claim), np. kolejka, do ktorej trafi plik
         """
-        self.lock.acquire()
-        try:
-            result1 = filepath in self.uploaded
-            result2 = filepath in self.pending
-            result  = (result1 or result2)
-            if (not result1) and (not result2):
-                self.pending.append(filepath)
-        finally:
-            self.lock.release()
-        return result
-    
-    def return_chdirlock(self):
-        return self.chdirs_lock
+        if meta == None:
+            meta = file_meta(filepath)
+        filepath = change_coding(filepath)
+        if self.uploaded.unchanged(filepath, meta):
+            return True
+        if not self.pending.claim(filepath, owner):
+            return True
+        #plik mogl zostac wyslany (i zwolniony) przez inny watek przed claim
+        if self.uploaded.unchanged(filepath, meta):
+            self.pending.release(filepath)
+            return True
+        return False
     
 if __name__ == '__main__':
     m = Model()
@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Adam (adam_gr [at] gazeta.pl)
+#
+# Released under: GNU GENERAL PUBLIC LICENSE
+#
+# Ver: 0.5
+
+import bisect
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import cache
+
+#Format pliku indeksu:
+#naglowek: magic (8 bajtow), liczba wpisow, liczba bitow filtra Blooma (po 8 bajtow)
+#wpisy posortowane wg skrotu sciezki: skrot (digest_size bajtow), rozmiar, mtime, inode
+#filtr Blooma (bloom_bits / 8 bajtow)
+#W wersji 1 (magic_v1) wpis zawieral tylko skrot sciezki.
+magic       = 'CUIDX002'
+magic_v1    = 'CUIDX001'
+header      = struct.Struct('>8sQQ')
+digest_size = 16
+record      = struct.Struct('>%dsQdQ' % digest_size)
+#rozmiar oznaczajacy brak informacji o pliku (wpisy z poprzednich wersji)
+unknown_size = 0xFFFFFFFFFFFFFFFF
+#filtr Blooma: liczba bitow na jeden wpis i liczba funkcji haszujacych
+bloom_bits_per_entry = 16
+bloom_hashes         = 4
+bloom_min_bits       = 1 << 16
+_bloom_struct        = struct.Struct('>%dI' % bloom_hashes)
+
+
+def digest(path):
+    return hashlib.sha1(path).digest()[:digest_size]
+
+
+def file_meta(st):
+    """
+    Zwraca (rozmiar, mtime, inode) dla wyniku os.stat
+    """
+    return (st.st_size, st.st_mtime, st.st_ino)
+
+
+def _pack(d, meta):
+    if meta == None:
+        return record.pack(d, unknown_size, 0., 0)
+    return record.pack(d, *meta)
+
+
+def _unpack(data):
+    d, size, mtime, inode = record.unpack(data)
+    if size == unknown_size:
+        return d, None
+    return d, (size, mtime, inode)
+
+
+_missing = object()
+
+
+class _Records(object):
+    """
+    Posortowane wpisy w zmapowanym pliku widziane jako sekwencja skrotow (dla bisect)
+    """
+    def __init__(self, mm, offset, count, size = record.size):
+        self.mm     = mm
+        self.offset = offset
+        self.count  = count
+        self.size   = size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        start = self.offset + i * self.size
+        return self.mm[start:start + digest_size]
+
+    def record(self, i):
+        start = self.offset + i * self.size
+        return _unpack(self.mm[start:start + self.size])
+
+    def chunks(self, n = 4096):
+        """
+        Zwraca kolejne wpisy (surowe dane, czytane po n naraz)
+        """
+        for first in xrange(0, self.count, n):
+            last  = min(first + n, self.count)
+            start = self.offset + first * self.size
+            data  = self.mm[start:self.offset + last * self.size]
+            for i in xrange(0, len(data), self.size):
+                yield data[i:i + self.size]
+
+
+class PathIndex(object):
+    """
+    Zbior sciezek (np. plikow wyslanych) przechowywany jako skroty o stalej dlugosci
+    wraz z rozmiarem, czasem modyfikacji i numerem inode pliku.
+    Wpisy zapisane w pliku sa posortowane i mapowane do pamieci (wyszukiwanie binarne),
+    nowe wpisy trzymane sa w pamieci (delta) az do wywolania merge().
+    Przed wyszukiwaniem w pliku sprawdzany jest filtr Blooma (gdy bloom == True).
+    Plik moze byc wspolny dla kilku procesow: merge odbywa sie pod blokada
+    flock (plik path.lock; bez modulu fcntl tylko blokada miedzy watkami)
+    i uwzglednia wpisy zapisane w miedzyczasie przez inne procesy.
+    """
+    def __init__(self, path, bloom = True):
+        self.lock   = threading.RLock()
+        self.path   = path
+        self.bloom  = None
+        #skrot -> (rozmiar, mtime, inode) lub None
+        self.delta  = {}
+        self.mm     = None
+        self.stored = _Records('', 0, 0)
+        #numer inode zmapowanego pliku (None - brak pliku)
+        self.inode  = None
+        self.locked = False
+        self.use_bloom = bloom
+        self._open()
+
+    def _open(self):
+        self.inode = None
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < header.size:
+            self._reset_bloom(0)
+            return
+        f = open(self.path, 'rb')
+        try:
+            self.inode = os.fstat(f.fileno()).st_ino
+            mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        finally:
+            f.close()
+        file_magic, count, nbits = header.unpack(mm[:header.size])
+        if file_magic == magic_v1:
+            self._upgrade_v1(mm, count)
+            return
+        end = header.size + count * record.size
+        if file_magic != magic or len(mm) < end + nbits / 8:
+            mm.close()
+            raise IOError('Uszkodzony plik indeksu: %s' % self.path)
+        self.mm     = mm
+        self.stored = _Records(mm, header.size, count)
+        if self.use_bloom and nbits > 0:
+            self.bloom = bytearray(mm[end:end + nbits / 8])
+        else:
+            self._reset_bloom(count)
+
+    def _upgrade_v1(self, mm, count):
+        """
+        Przepisuje indeks z wersji 1 (same skroty, bez informacji o plikach)
+        """
+        try:
+            for d in _Records(mm, header.size, count, digest_size).chunks():
+                self.delta[d] = None
+        finally:
+            mm.close()
+        self._reset_bloom(0)
+        self.merge()
+
+    def _reset_bloom(self, count):
+        """
+        Tworzy pusty filtr Blooma dla count wpisow i dodaje do niego skroty z pliku
+        """
+        if not self.use_bloom:
+            self.bloom = None
+            return
+        nbits = bloom_min_bits
+        while nbits < count * bloom_bits_per_entry:
+            nbits *= 2
+        self.bloom = bytearray(nbits / 8)
+        for data in self.stored.chunks():
+            self._bloom_add(data[:digest_size])
+
+    def _bloom_positions(self, d):
+        nbits = len(self.bloom) * 8
+        return [ h % nbits for h in _bloom_struct.unpack(d[:4 * bloom_hashes]) ]
+
+    def _bloom_add(self, d):
+        for pos in self._bloom_positions(d):
+            self.bloom[pos >> 3] |= 1 << (pos & 7)
+
+    def _bloom_check(self, d):
+        for pos in self._bloom_positions(d):
+            if not self.bloom[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def _stored_find(self, d):
+        """
+        Zwraca numer wpisu ze skrotem d w pliku lub None
+        """
+        if self.bloom != None and not self._bloom_check(d):
+            return None
+        i = bisect.bisect_left(self.stored, d)
+        if i < len(self.stored) and self.stored[i] == d:
+            return i
+        return None
+
+    def _find(self, d):
+        """
+        Zwraca (czy_jest, (rozmiar, mtime, inode) lub None)
+        """
+        meta = self.delta.get(d, _missing)
+        if meta is not _missing:
+            return True, meta
+        self.lock.acquire()
+        try:
+            i = self._stored_find(d)
+            if i == None:
+                return False, None
+            return True, self.stored.record(i)[1]
+        finally:
+            self.lock.release()
+
+    ###########################################################################
+    def __contains__(self, path):
+        return self._find(digest(path))[0]
+
+    def __len__(self):
+        return len(self.stored) + len(self.delta)
+
+    def lookup(self, path):
+        """
+        Zwraca (czy_jest, (rozmiar, mtime, inode) zapisane dla path lub None)
+        """
+        return self._find(digest(path))
+
+    def unchanged(self, path, meta):
+        """
+        Czy path jest w indeksie i plik sie nie zmienil (ten sam rozmiar,
+        mtime i inode). Wpisy bez informacji o pliku uznawane sa za niezmienione.
+        """
+        found, stored_meta = self._find(digest(path))
+        return found and (stored_meta == None or meta == None or stored_meta == tuple(meta))
+
+    def add(self, path, meta = None):
+        """
+        Dodaje (lub aktualizuje) sciezke; zwraca False, gdy juz byla
+        w indeksie z tymi samymi danymi
+        """
+        d = digest(path)
+        if meta != None:
+            meta = tuple(meta)
+        self.lock.acquire()
+        try:
+            found, stored_meta = self._find(d)
+            if found and (meta == None or stored_meta == meta):
+                return False
+            self.delta[d] = meta
+            if self.bloom != None:
+                self._bloom_add(d)
+            return True
+        finally:
+            self.lock.release()
+
+    def reload(self):
+        """
+        Ponownie mapuje plik, jezeli zostal zastapiony przez inny proces
+        (wpisy z delty zostaja zachowane)
+        """
+        self.lock.acquire()
+        try:
+            try:
+                inode = os.stat(self.path).st_ino
+            except OSError:
+                inode = None
+            if inode == self.inode:
+                return
+            if self.mm != None:
+                self.mm.close()
+                self.mm = None
+            self.stored = _Records('', 0, 0)
+            self._open()
+            if self.bloom != None:
+                for d in self.delta:
+                    self._bloom_add(d)
+        finally:
+            self.lock.release()
+
+    def merge(self):
+        """
+        Zapisuje do pliku wpisy z pliku i z delty (scalajac posortowane ciagi;
+        wpis z delty zastepuje wpis z pliku o tym samym skrocie)
+        """
+        self.lock.acquire()
+        try:
+            if self.locked:
+                #wywolanie z _open (przepisanie indeksu z wersji 1)
+                self._merge()
+                return
+            fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0600)
+            try:
+                cache.lock_file(fd)
+                self.locked = True
+                try:
+                    #plik mogl zostac w miedzyczasie zapisany przez inny proces
+                    self.reload()
+                    self._merge()
+                finally:
+                    self.locked = False
+            finally:
+                #zamkniecie deskryptora zwalnia blokade
+                os.close(fd)
+        finally:
+            self.lock.release()
+
+    def _merge(self):
+        if not self.delta and self.mm != None:
+            return
+        count = len(self.stored) + len(self.delta)
+        if self.bloom != None and len(self.bloom) * 8 < count * bloom_bits_per_entry / 2:
+            #filtr zbyt maly - za duzo falszywych trafien
+            self._rebuild_bloom(count)
+        tmp = self.path + '.tmp'
+        f   = open(tmp, 'wb')
+        try:
+            f.write(header.pack(magic, 0, 0))
+            buf   = []
+            delta = sorted(self.delta)
+            j     = 0
+            count = 0
+            for data in self.stored.chunks():
+                d = data[:digest_size]
+                while j < len(delta) and delta[j] < d:
+                    buf.append(_pack(delta[j], self.delta[delta[j]]))
+                    j += 1
+                if j < len(delta) and delta[j] == d:
+                    #zaktualizowany wpis
+                    continue
+                buf.append(data)
+                if len(buf) >= 4096:
+                    f.write(''.join(buf))
+                    count += len(buf)
+                    buf    = []
+            buf.extend([ _pack(d, self.delta[d]) for d in delta[j:] ])
+            f.write(''.join(buf))
+            count += len(buf)
+            nbits  = 0
+            if self.bloom != None:
+                nbits = len(self.bloom) * 8
+                f.write(str(self.bloom))
+            f.seek(0)
+            f.write(header.pack(magic, count, nbits))
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        if self.mm != None:
+            self.mm.close()
+            self.mm = None
+        cache.replace(tmp, self.path)
+        self.delta  = {}
+        self.stored = _Records('', 0, 0)
+        self._open()
+
+    def _rebuild_bloom(self, count):
+        self._reset_bloom(count)
+        for d in self.delta:
+            self._bloom_add(d)
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            if self.mm != None:
+                self.mm.close()
+                self.mm     = None
+                self.stored = _Records('', 0, 0)
+                self.inode  = None
+        finally:
+            self.lock.release()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Adam (adam_gr [at] gazeta.pl)
+#
+# Released under: GNU GENERAL PUBLIC LICENSE
+#
+# Ver: 0.5
+
+import os
+import Queue
+import threading
+import scheduler
+
+#dla ilu kolejnych plikow pobierane sa tokeny z wyprzedzeniem
+default_depth = 4
+#maksymalna liczba watkow pobierajacych tokeny
+max_threads   = 4
+
+
+class _Slot(object):
+    """
+    Element kolejki wraz z (pobieranymi w tle) tokenami
+    """
+    def __init__(self, item):
+        self.item   = item
+        self.tokens = None
+        self.done   = threading.Event()
+
+
+class Prefetcher(object):
+    """
+    Pobieranie tokenow UploadToken dla kolejnych depth plikow z kolejki,
+    w czasie gdy wysylany jest biezacy plik - dzieki temu wysylanie
+    malego pliku nie czeka na osobne zapytanie SOAP.
+    Tokeny pobiera chomik (zalogowany Chomik), a wygasle tokeny
+    odrzuca Chomik.upload.
+    """
+    def __init__(self, chomik, depth = default_depth):
+        self.chomik = chomik
+        self.depth  = depth
+
+    def fetch(self, filepath, folder_id):
+        """
+        Zwraca tokeny do wyslania pliku filepath (lub None przy bledzie)
+        """
+        self.chomik.relogin()
+        try:
+            return self.chomik.prefetch_upload_tokens(os.path.basename(filepath), folder_id)
+        except Exception:
+            #plik zostanie wyslany bez tokenu pobranego z wyprzedzeniem
+            return None
+
+    def filter(self, items):
+        """
+        Dla kolejnych elementow (sciezka_pliku, id_katalogu[, klucz_zawartosci])
+        z items pobiera w tle tokeny i zwraca, w tej samej kolejnosci,
+        (sciezka_pliku, id_katalogu, klucz_zawartosci, tokeny).
+        Elementy z items odczytywane sa w osobnym watku, wiec kazdy element
+        zwracany jest, gdy tylko ma tokeny - filter nie wstrzymuje elementow
+        (np. Dedup.filter czeka na zakonczenie wysylania tych, ktore juz zwrocil).
+        """
+        def handler(slot):
+            try:
+                slot.tokens = self.fetch(*slot.item[:2])
+            finally:
+                slot.done.set()
+        window  = Queue.Queue(self.depth)
+        sched   = scheduler.Scheduler(lambda: handler, min(self.depth, max_threads), queue_size = self.depth)
+        errors  = []
+        stopped = threading.Event()
+        def put(slot):
+            #konsument mogl przestac odbierac elementy (stopped)
+            while not stopped.is_set():
+                try:
+                    window.put(slot, True, 1.)
+                    return True
+                except Queue.Full:
+                    pass
+            return False
+        def produce():
+            try:
+                try:
+                    for item in items:
+                        slot = _Slot(item)
+                        sched.put(slot)
+                        if not put(slot):
+                            break
+                except Exception, e:
+                    errors.append(e)
+            finally:
+                sched.close()
+                put(None)
+        sched.start()
+        producer = threading.Thread(target = produce)
+        producer.daemon = True
+        producer.start()
+        try:
+            while True:
+                try:
+                    #czekanie z timeoutem, zeby Ctrl+C przerywal program
+                    slot = window.get(True, 1.)
+                except Queue.Empty:
+                    continue
+                if slot == None:
+                    break
+                yield self.__ready(slot)
+            if errors:
+                raise errors[0]
+        finally:
+            stopped.set()
+
+    def __ready(self, slot):
+        #czekanie z timeoutem, zeby Ctrl+C przerywal program
+        while not slot.done.is_set():
+            slot.done.wait(1.)
+        item = tuple(slot.item)
+        if len(item) < 3:
+            item += (None,)
+        return item[:3] + (slot.tokens,)
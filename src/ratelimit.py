@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Adam (adam_gr [at] gazeta.pl)
+#
+# Released under: GNU GENERAL PUBLIC LICENSE
+#
+# Ver: 0.5
+
+import re
+import threading
+import time
+
+#najmniejsza i najwieksza porcja danych przydzielana jednorazowo
+min_quantum = 16 * 1024
+max_quantum = 1024 * 1024
+
+_units = {'' : 1, 'b' : 1, 'k' : 1024, 'm' : 1024 * 1024, 'g' : 1024 * 1024 * 1024}
+
+
+def parse_rate(text):
+    """
+    '500k' -> 512000 (bajtow na sekunde); 0 lub '-' oznacza brak ograniczenia
+    """
+    text = text.strip().lower()
+    if text in ('', '-', '0'):
+        return None
+    m = re.match(r'^(\d+(?:\.\d+)?)\s*([bkmg]?)(?:b|/s|b/s)?$', text)
+    if m == None:
+        raise ValueError('Niepoprawna predkosc: %s' % text)
+    rate = int(float(m.group(1)) * _units[m.group(2)])
+    if rate <= 0:
+        return None
+    return rate
+
+
+def _parse_time(text):
+    hour, _, minute = text.partition(':')
+    return int(hour) * 60 + int(minute or 0)
+
+
+class Schedule(object):
+    """
+    Predkosci zalezne od pory dnia, np. '8:00-22:00=200k,22:00-8:00=2M'
+    (przedzialy moga przechodzic przez polnoc; poza przedzialami - bez ograniczen)
+    """
+    def __init__(self, spec):
+        self.ranges = []
+        for part in spec.split(','):
+            period, _, rate = part.partition('=')
+            start, _, end = period.partition('-')
+            self.ranges.append( (_parse_time(start), _parse_time(end), parse_rate(rate)) )
+
+    def rate_at(self, t = None):
+        lt     = time.localtime(t)
+        minute = lt.tm_hour * 60 + lt.tm_min
+        for start, end, rate in self.ranges:
+            if start <= end:
+                if start <= minute < end:
+                    return rate
+            elif minute >= start or minute < end:
+                return rate
+        return None
+
+
+class TokenBucket(object):
+    """
+    Wspolny dla wszystkich transferow limit predkosci (rate bajtow na sekunde,
+    None - bez ograniczen). Kazdy transfer pobiera przydzial przed wyslaniem
+    kolejnej porcji danych; przydzialy realizowane sa w kolejnosci zgloszen,
+    wiec rownoczesne transfery dziela sie przepustowoscia po rowno.
+    """
+    def __init__(self, rate = None, schedule = None):
+        self.lock     = threading.Lock()
+        self.rate     = rate
+        self.schedule = schedule
+        #dostepne bajty (ujemne - dlug zaciagniety przez oczekujacych)
+        self.tokens   = 0.
+        self.last     = time.time()
+        #kiedy ostatnio sprawdzano harmonogram
+        self.checked  = 0
+
+    def set_rate(self, rate):
+        """
+        Zmiana limitu w trakcie dzialania programu
+        """
+        self.lock.acquire()
+        try:
+            self._refill(time.time())
+            self.rate = rate
+        finally:
+            self.lock.release()
+
+    def set_schedule(self, schedule):
+        self.lock.acquire()
+        try:
+            self.schedule = schedule
+            self.checked  = 0
+        finally:
+            self.lock.release()
+
+    def _refill(self, now):
+        if self.schedule != None and now - self.checked >= 30:
+            self.checked = now
+            self.rate    = self.schedule.rate_at(now)
+        if self.rate != None:
+            #zapas nie wiekszy niz na jedna sekunde
+            burst       = max(self.rate, min_quantum)
+            self.tokens = min(burst, self.tokens + (now - self.last) * self.rate)
+        else:
+            self.tokens = 0.
+        self.last = now
+
+    def limited(self):
+        return self.rate != None or self.schedule != None
+
+    def quantum(self):
+        """
+        Zalecana wielkosc porcji danych (ok. 1/4 sekundy transferu)
+        """
+        rate = self.rate
+        if rate == None:
+            return max_quantum
+        return max(min_quantum, min(max_quantum, rate / 4))
+
+    def reserve(self, n):
+        """
+        Rezerwuje n bajtow; zwraca liczbe sekund, ktore trzeba odczekac
+        przed ich wyslaniem
+        """
+        self.lock.acquire()
+        try:
+            self._refill(time.time())
+            if self.rate == None:
+                return 0.
+            self.tokens -= n
+            if self.tokens >= 0:
+                return 0.
+            return -self.tokens / self.rate
+        finally:
+            self.lock.release()
+
+    def acquire(self, n):
+        """
+        Czeka, az bedzie mozna wyslac n bajtow
+        """
+        delay = self.reserve(n)
+        if delay > 0:
+            time.sleep(delay)
+
+
+#ogranicznik uzywany przez transfer.send_file i engine.Engine
+limiter = TokenBucket()
+
+
+def configure(spec):
+    """
+    Ustawia limit z parametru programu: predkosc ('500k') lub harmonogram
+    ('8:00-22:00=200k,22:00-8:00=2M')
+    """
+    if '=' in spec:
+        limiter.set_schedule(Schedule(spec))
+    else:
+        limiter.set_schedule(None)
+        limiter.set_rate(parse_rate(spec))
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Adam (adam_gr [at] gazeta.pl)
+#
+# Released under: GNU GENERAL PUBLIC LICENSE
+#
+# Ver: 0.5
+
+import socket
+import threading
+import time
+
+#jak dlugo (w sekundach) pamietane sa adresy hosta - biblioteka standardowa
+#nie podaje TTL rekordow DNS, wiec jest on ustalany tutaj
+ttl          = 300
+#jak dlugo pamietane sa nieudane zapytania
+negative_ttl = 10
+
+
+class Resolver(object):
+    """
+    Wspolna dla wszystkich watkow pamiec podreczna zapytan DNS.
+    Gdy serwer DNS chwilowo nie odpowiada, uzywane sa ostatnio znane
+    (przeterminowane) adresy; nieudane zapytania bez znanych adresow
+    pamietane sa przez negative_ttl sekund.
+    """
+    def __init__(self, ttl = ttl, negative_ttl = negative_ttl):
+        self.ttl          = ttl
+        self.negative_ttl = negative_ttl
+        self.lock         = threading.Lock()
+        #host -> (termin waznosci, lista adresow lub None, blad)
+        self.entries      = {}
+        #host -> liczniki
+        self.counters     = {}
+
+    def __count(self, host, name, value = 1):
+        counters = self.counters.get(host)
+        if counters == None:
+            counters = self.counters[host] = {'lookups' : 0, 'hits' : 0, 'negative_hits' : 0,
+                                              'stale_hits' : 0, 'failures' : 0, 'failovers' : 0,
+                                              'lookup_time' : 0., 'saved_time' : 0.}
+        counters[name] += value
+        return counters
+
+    def resolve(self, host):
+        """
+        Zwraca liste adresow IP hosta (pierwszy - preferowany)
+        """
+        now = time.time()
+        self.lock.acquire()
+        try:
+            entry = self.entries.get(host)
+            if entry != None and entry[0] > now:
+                if entry[1] == None:
+                    self.__count(host, 'negative_hits')
+                    raise entry[2]
+                counters = self.__count(host, 'hits')
+                #oszczednosc: sredni czas zapytania
+                if counters['lookups']:
+                    counters['saved_time'] += counters['lookup_time'] / counters['lookups']
+                return list(entry[1])
+        finally:
+            self.lock.release()
+        start = time.time()
+        try:
+            addresses = socket.gethostbyname_ex(host)[2]
+            error     = None
+        except socket.error, e:
+            addresses = None
+            error     = e
+        elapsed = time.time() - start
+        self.lock.acquire()
+        try:
+            self.__count(host, 'lookups')
+            self.__count(host, 'lookup_time', elapsed)
+            if addresses:
+                self.entries[host] = (time.time() + self.ttl, addresses, None)
+                return list(addresses)
+            self.__count(host, 'failures')
+            if error == None:
+                error = socket.gaierror(socket.EAI_NONAME, 'brak adresow: %s' % host)
+            if entry != None and entry[1] != None:
+                #chwilowy blad DNS - ostatnio znane adresy
+                self.__count(host, 'stale_hits')
+                self.entries[host] = (time.time() + self.negative_ttl, entry[1], None)
+                return list(entry[1])
+            self.entries[host] = (time.time() + self.negative_ttl, None, error)
+            raise error
+        finally:
+            self.lock.release()
+
+    def failed(self, host, address):
+        """
+        Nie udalo sie polaczyc z address - przesuwa go na koniec listy adresow hosta
+        """
+        self.lock.acquire()
+        try:
+            entry = self.entries.get(host)
+            if entry == None or entry[1] == None or address not in entry[1] or len(entry[1]) < 2:
+                return
+            addresses = [ i for i in entry[1] if i != address ] + [address]
+            self.entries[host] = (entry[0], addresses, None)
+            self.__count(host, 'failovers')
+        finally:
+            self.lock.release()
+
+    def connect(self, host, port, timeout = None):
+        """
+        Zwraca gniazdo polaczone z host:port; gdy polaczenie z adresem sie nie
+        uda, probowane sa kolejne adresy hosta
+        """
+        error = None
+        for address in self.resolve(host):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.settimeout(timeout)
+            try:
+                sock.connect( (address, port) )
+                return sock
+            except socket.error, e:
+                sock.close()
+                self.failed(host, address)
+                error = e
+        raise error
+
+    def stats(self):
+        """
+        Zwraca liczniki dla kazdego hosta: zapytania do DNS, trafienia (rowniez
+        zapamietanych bledow i przeterminowanych adresow), bledy, przelaczenia
+        na inny adres oraz czas zapytan i zaoszczedzony czas (w sekundach)
+        """
+        self.lock.acquire()
+        try:
+            return dict( (host, dict(counters)) for host, counters in self.counters.iteritems() )
+        finally:
+            self.lock.release()
+
+
+#wspolny dla calego procesu
+resolver = Resolver()
+
+
+def resolve(host):
+    return resolver.resolve(host)
+
+
+def connect(host, port, timeout = None):
+    return resolver.connect(host, port, timeout)
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Adam (adam_gr [at] gazeta.pl)
+#
+# Released under: GNU GENERAL PUBLIC LICENSE
+#
+# Ver: 0.5
+
+import Queue
+import socket
+import threading
+import time
+import traceback
+import cache
+import transfer
+
+
+class Worker(threading.Thread):
+    """
+    Watek pobierajacy zadania z kolejki i przekazujacy je do handler(item)
+    """
+    def __init__(self, queue, handler, controller = None):
+        threading.Thread.__init__(self)
+        self.queue      = queue
+        self.handler    = handler
+        self.controller = controller
+        self.daemon     = True
+
+    def run(self):
+        while True:
+            if self.controller != None:
+                self.controller.enter()
+            item = self.queue.get()
+            ok   = False
+            try:
+                if item is None:
+                    return
+                #handler zwraca False, gdy zadanie sie nie powiodlo
+                ok = self.handler(item) is not False
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self.queue.task_done()
+                if self.controller != None:
+                    self.controller.leave(ok, item is None)
+
+
+class Controller(object):
+    """
+    Automatyczny dobor liczby jednoczesnie pracujacych watkow (AIMD).
+    Co interval sekund porownywana jest przepustowosc (bajty/s i pliki/s)
+    z poprzednim pomiarem: gdy rosnie - dodajemy watek, gdy nie wzrosla
+    po zwiekszeniu - cofamy zmiane, a przy duzej liczbie bledow liczba
+    watkow jest zmniejszana o polowe.
+    Najlepsze ustawienie zapamietywane jest w pliku (dla konta i komputera).
+    """
+    #ulamek nieudanych zadan, powyzej ktorego zmniejszamy liczbe watkow
+    max_error_rate = 0.1
+
+    def __init__(self, user = None, initial = 4, minimum = 1, maximum = 32, interval = 10.):
+        self.cond      = threading.Condition()
+        self.minimum   = minimum
+        self.maximum   = maximum
+        self.interval  = interval
+        self.cache_file = None
+        self.host      = socket.gethostname()
+        if user != None:
+            self.cache_file = cache.cache_path('concurrency.txt', user)
+            initial = self.load(initial)
+        self.limit     = max(minimum, min(maximum, initial))
+        self.active    = 0
+        self.best      = (0., self.limit)
+        #pomiary w biezacym okresie
+        self.period_start = time.time()
+        self.period_bytes = transfer.bytes_sent()
+        self.files     = 0
+        self.errors    = 0
+        self.prev_rate = None
+        self.last_step = 0
+        self.held      = 0
+
+    def enter(self):
+        """
+        Czeka, az watek bedzie mogl wziac kolejne zadanie
+        """
+        self.cond.acquire()
+        try:
+            while self.active >= self.limit:
+                self.cond.wait(1.)
+            self.active += 1
+        finally:
+            self.cond.release()
+
+    def leave(self, ok, finished = False):
+        self.cond.acquire()
+        try:
+            self.active -= 1
+            if not finished:
+                self.files += 1
+                if not ok:
+                    self.errors += 1
+            if time.time() - self.period_start >= self.interval:
+                self.adjust()
+            self.cond.notify_all()
+        finally:
+            self.cond.release()
+
+    def adjust(self):
+        now     = time.time()
+        sent    = transfer.bytes_sent()
+        elapsed = max(now - self.period_start, 1e-3)
+        rate    = (sent - self.period_bytes) / elapsed
+        files   = self.files / elapsed
+        errors  = self.errors / float(max(self.files, 1))
+        self.period_start = now
+        self.period_bytes = sent
+        self.files        = 0
+        self.errors       = 0
+        if errors > self.max_error_rate:
+            step = -(self.limit - max(self.minimum, self.limit / 2))
+        elif self.prev_rate == None:
+            step = 1
+        else:
+            prev_bytes, prev_files = self.prev_rate
+            better = rate > prev_bytes * 1.05 or files > prev_files * 1.05
+            if better:
+                step = 1
+            elif self.last_step > 0:
+                #dodatkowy watek nic nie dal - cofamy zmiane
+                step = -1
+            elif self.held >= 3:
+                #sprawdzamy co jakis czas, czy wiecej watkow nie pomoze
+                step = 1
+            else:
+                step = 0
+        if errors <= self.max_error_rate and rate > self.best[0]:
+            self.best = (rate, self.limit)
+        self.prev_rate = (rate, files)
+        self.held      = (step == 0) and self.held + 1 or 0
+        self.last_step = step
+        self.limit     = max(self.minimum, min(self.maximum, self.limit + step))
+
+    def load(self, default):
+        try:
+            f = open(self.cache_file, 'rb')
+        except IOError:
+            return default
+        try:
+            for line in f:
+                host, _, limit = line.rstrip('\r\n').partition('\t')
+                if host == self.host:
+                    try:
+                        return int(limit)
+                    except ValueError:
+                        pass
+        finally:
+            f.close()
+        return default
+
+    def save(self):
+        """
+        Zapamietuje liczbe watkow, przy ktorej przepustowosc byla najwieksza
+        """
+        if self.cache_file == None:
+            return
+        lines = []
+        try:
+            f = open(self.cache_file, 'rb')
+            try:
+                lines = [ line for line in f if line.partition('\t')[0] != self.host ]
+            finally:
+                f.close()
+        except IOError:
+            pass
+        limit = self.best[1]
+        if self.best[0] == 0.:
+            limit = self.limit
+        lines.append('%s\t%d\n' % (self.host, limit))
+        cache.write_atomic(self.cache_file, ''.join(lines))
+
+
+class Scheduler(object):
+    """
+    Ograniczona kolejka zadan i pula watkow, ktore je wykonuja.
+    handler_factory wywolywane jest raz dla kazdego watku (w watku glownym)
+    i zwraca funkcje obslugujaca pojedyncze zadanie.
+    Z controller (Controller) liczba watkow dobierana jest automatycznie
+    (n jest wtedy ignorowane), a nowe watki uruchamiane sa w miare potrzeby.
+    """
+    def __init__(self, handler_factory, n, queue_size = None, controller = None):
+        self.controller      = controller
+        if controller != None:
+            n = controller.limit
+        if queue_size == None:
+            queue_size = 4 * n
+        self.handler_factory = handler_factory
+        self.n               = n
+        self.queue           = Queue.Queue(queue_size)
+        self.workers         = []
+
+    def start(self):
+        for i in xrange(self.n):
+            self._spawn()
+
+    def _spawn(self):
+        worker = Worker(self.queue, self.handler_factory(), self.controller)
+        worker.start()
+        self.workers.append(worker)
+
+    def put(self, item):
+        """
+        Dodaje zadanie; blokuje, gdy kolejka jest pelna
+        """
+        if self.controller != None:
+            while len(self.workers) < self.controller.limit:
+                self._spawn()
+        self.queue.put(item)
+
+    def close(self):
+        """
+        Koniec zadan - kazdy watek konczy prace po oproznieniu kolejki
+        """
+        for worker in self.workers:
+            self.queue.put(None)
+
+    def join(self):
+        #join z timeoutem, zeby Ctrl+C przerywal program
+        for worker in self.workers:
+            while worker.is_alive():
+                worker.join(1.)
+        if self.controller != None:
+            try:
+                self.controller.save()
+            except (IOError, OSError):
+                pass
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Adam (adam_gr [at] gazeta.pl)
+#
+# Released under: GNU GENERAL PUBLIC LICENSE
+#
+# Ver: 0.5
+
+import binascii
+import hashlib
+import os
+import threading
+import time
+import cache
+
+#po jakim czasie (w sekundach) sesja uznawana jest za niewazna
+session_ttl     = 300
+#na ile sekund przed wygasnieciem sesja odswiezana jest w tle
+#(przy pierwszym uzyciu w tym czasie)
+refresh_margin  = 60
+#blad zapytania z tokenem mlodszym niz min_age sekund nie jest uznawany
+#za odrzucenie sesji (np. blad dotyczy katalogu, a nie sesji)
+min_age         = 30
+#jak dlugo (w sekundach) mozna uzywac sesji zapisanej na dysku
+#przez poprzednie uruchomienie programu
+cache_ttl       = 1800
+#liczba iteracji skrotu hasla zapisanego razem z sesja
+hash_rounds     = 100000
+
+
+def password_hash(password, salt):
+    """
+    Solony, celowo wolny skrot hasla (PBKDF2-SHA256; w starszych wersjach
+    Pythona - iterowany SHA256). Pozwala sprawdzic haslo przed uzyciem
+    zapisanej sesji, a odgadywanie hasla na podstawie pliku jest kosztowne.
+    """
+    if hasattr(hashlib, 'pbkdf2_hmac'):
+        return binascii.hexlify(hashlib.pbkdf2_hmac('sha256', password, salt, hash_rounds))
+    digest = salt + password
+    for i in xrange(hash_rounds):
+        digest = hashlib.sha256(digest + password).digest()
+    return binascii.hexlify(digest)
+
+
+def _equal(a, b):
+    """
+    Porownanie napisow w czasie niezaleznym od miejsca pierwszej roznicy
+    """
+    if len(a) != len(b):
+        return False
+    result = 0
+    for x, y in zip(a, b):
+        result |= ord(x) ^ ord(y)
+    return result == 0
+
+
+class Session(object):
+    """
+    Sesja (token i id chomika) wspolna dla wszystkich watkow procesu.
+    Logowanie odbywa sie raz; sesja uzyta na krotko przed wygasnieciem
+    odswiezana jest w tle, a watki odczytuja ja bez czekania.
+    auth() - logowanie, zwraca (ses_id, chomik_id) lub None.
+    Sesja zapisywana jest w cache_file (tylko dla wlasciciela), wiec kolejne
+    uruchomienia programu w ciagu cache_ttl sekund nie musza sie logowac.
+    Zapisana sesja uzywana jest tylko wtedy, gdy zgadza sie user, a haslo -
+    ze skrotem zapisanym w pliku (password_hash); waznosc wczytanego tokenu
+    sprawdza dodatkowo serwer (rejected).
+    """
+    def __init__(self, auth, cache_file = None, user = '', password = ''):
+        self.auth       = auth
+        self.lock       = threading.Lock()
+        #(ses_id, chomik_id, czas_logowania, czas_wygasniecia) - podmieniane w calosci
+        self.current    = None
+        #watek odswiezajacy sesje (tylko jeden naraz)
+        self.refreshing = False
+        self.cache_file = cache_file
+        self.user       = user or ''
+        self.password   = password or ''
+        #(sol, skrot hasla) zapisywane razem z sesja - liczone raz
+        self.check      = None
+        #token wczytany z dysku, ktorego serwer jeszcze nie odrzucil
+        self.restored   = None
+        self.tried_cache = cache_file == None
+
+    def valid(self, current):
+        return current != None and time.time() < current[3]
+
+    def ready(self):
+        """
+        Czy jest wazna sesja - get() zwroci ja bez czekania na logowanie
+        """
+        return self.valid(self.current)
+
+    def get(self):
+        """
+        Zwraca (ses_id, chomik_id) lub None, gdy nie udalo sie zalogowac.
+        Czeka tylko wtedy, gdy nie ma waznej sesji.
+        """
+        current = self.current
+        if not self.valid(current):
+            self.lock.acquire()
+            try:
+                current = self.current
+                if not self.valid(current):
+                    current = self.__restore() or self.__login()
+            finally:
+                self.lock.release()
+            if current == None:
+                return None
+        elif time.time() > current[3] - refresh_margin:
+            self.__refresh(current)
+        return current[:2]
+
+    def rejected(self, ses_id):
+        """
+        Zapytanie z tokenem ses_id zakonczylo sie bledem. Jezeli token
+        mogl wygasnac (pochodzil z dysku lub nie jest swiezy), sesja jest
+        uniewazniana i zwracane jest True - zapytanie warto powtorzyc
+        po ponownym logowaniu. True jest zwracane rowniez wtedy, gdy inny
+        watek juz pobral nowy token.
+        """
+        self.lock.acquire()
+        try:
+            current = self.current
+            if current == None or current[0] != ses_id:
+                return True
+            if ses_id != self.restored and time.time() - current[2] < min_age:
+                return False
+        finally:
+            self.lock.release()
+        self.invalidate(ses_id)
+        return True
+
+    def invalidate(self, ses_id = None):
+        """
+        Sesja odrzucona przez serwer - nastepne get() zaloguje sie ponownie
+        (ses_id - odrzucony token; inny, nowszy token nie jest usuwany)
+        """
+        self.lock.acquire()
+        try:
+            if self.current != None and (ses_id == None or self.current[0] == ses_id):
+                self.current  = None
+                self.restored = None
+        finally:
+            self.lock.release()
+        self.__remove_cache()
+
+    def __login(self):
+        result = self.auth()
+        if result == None:
+            return None
+        now          = time.time()
+        self.current = (result[0], result[1], now, now + session_ttl)
+        self.__store()
+        return self.current
+
+    def __refresh(self, current):
+        """
+        Logowanie w tle - dotychczasowa sesja jest uzywana do czasu jego zakonczenia
+        """
+        self.lock.acquire()
+        try:
+            if self.refreshing or self.current is not current:
+                return
+            self.refreshing = True
+        finally:
+            self.lock.release()
+        def refresh():
+            self.lock.acquire()
+            try:
+                #sesja mogla zostac w miedzyczasie odswiezona przez get()
+                if self.current is current:
+                    try:
+                        self.__login()
+                    except Exception:
+                        #dotychczasowa sesja pozostaje wazna az do wygasniecia
+                        pass
+            finally:
+                self.refreshing = False
+                self.lock.release()
+        thread = threading.Thread(target = refresh)
+        thread.daemon = True
+        thread.start()
+
+    def __restore(self):
+        """
+        Wczytuje sesje zapisana przez poprzednie uruchomienie programu
+        (tylko raz, przy pierwszym logowaniu)
+        """
+        if self.tried_cache:
+            return None
+        self.tried_cache = True
+        try:
+            f = open(self.cache_file, 'rb')
+            try:
+                ses_id, chomik_id, stamp, user, salt, check = f.read().strip().split('\t')
+            finally:
+                f.close()
+            stamp = float(stamp)
+        except (IOError, ValueError):
+            return None
+        now = time.time()
+        if user != self.user or not 0 <= now - stamp < cache_ttl:
+            return None
+        if not _equal(password_hash(self.password, salt), check):
+            return None
+        self.check    = (salt, check)
+        self.restored = ses_id
+        #sesja z dysku zachowuje czas logowania - nie jest uzywana dluzej niz
+        #cache_ttl od zapisu ani dluzej niz session_ttl od wczytania
+        self.current = (ses_id, chomik_id, stamp, min(stamp + cache_ttl, now + session_ttl))
+        return self.current
+
+    def __store(self):
+        if self.cache_file == None:
+            return
+        ses_id, chomik_id, stamp, expires = self.current
+        if self.check == None:
+            salt       = binascii.hexlify(os.urandom(16))
+            self.check = (salt, password_hash(self.password, salt))
+        salt, check = self.check
+        try:
+            cache.write_atomic(self.cache_file, '%s\t%s\t%r\t%s\t%s\t%s\n' % (ses_id, chomik_id, stamp, self.user, salt, check))
+        except (IOError, OSError):
+            pass
+
+    def __remove_cache(self):
+        if self.cache_file == None:
+            return
+        try:
+            os.remove(self.cache_file)
+        except OSError:
+            pass
+
+
+#####################################################################################################
+#sesje wspolne dla wszystkich watkow (po jednej na konto)
+_sessions      = {}
+_sessions_lock = threading.Lock()
+
+def shared_session(user, password, auth):
+    """
+    Zwraca sesje konta user; auth() uzywane jest do logowania
+    """
+    _sessions_lock.acquire()
+    try:
+        ses = _sessions.get( (user, password) )
+        if ses == None:
+            ses = Session(auth, cache.cache_path('session.txt', user), user, password)
+            _sessions[(user, password)] = ses
+        return ses
+    finally:
+        _sessions_lock.release()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Adam (adam_gr [at] gazeta.pl)
+#
+# Released under: GNU GENERAL PUBLIC LICENSE
+#
+# Ver: 0.5
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import socket
+import sys
+import threading
+import ratelimit
+
+#rozmiar bloku, po ktorym aktualizowany jest postep wysylania
+block_size = 1024 * 1024
+
+
+class SendfileUnavailable(Exception):
+    pass
+
+
+#laczna liczba bajtow wyslanych przez send_file (np. do pomiaru przepustowosci)
+_sent_lock  = threading.Lock()
+_sent_total = [0]
+
+def bytes_sent():
+    return _sent_total[0]
+
+def _count_sent(n):
+    _sent_lock.acquire()
+    try:
+        _sent_total[0] += n
+    finally:
+        _sent_lock.release()
+
+###############################################################################################################
+#sendfile: os.sendfile (python >= 3.3) lub bezposrednio z libc na Linuksie
+_libc_sendfile = None
+if not hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+    try:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno = True)
+        _libc_sendfile = getattr(_libc, 'sendfile64', None) or _libc.sendfile
+        _libc_sendfile.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_longlong), ctypes.c_size_t]
+        _libc_sendfile.restype  = ctypes.c_ssize_t
+    except (OSError, AttributeError):
+        _libc_sendfile = None
+
+
+def _sendfile(out_fd, in_fd, offset, count):
+    """
+    Zwraca liczbe wyslanych bajtow; przy bledzie rzuca OSError
+    """
+    if hasattr(os, 'sendfile'):
+        return os.sendfile(out_fd, in_fd, offset, count)
+    off  = ctypes.c_longlong(offset)
+    sent = _libc_sendfile(out_fd, in_fd, ctypes.byref(off), count)
+    if sent < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return sent
+
+
+def sendfile_available():
+    return hasattr(os, 'sendfile') or _libc_sendfile is not None
+
+
+def _wait_writable(sock):
+    """
+    Gniazdo z ustawionym timeoutem jest nieblokujace, wiec przy EAGAIN
+    czekamy, az bedzie mozna do niego pisac
+    """
+    timeout = sock.gettimeout()
+    _, writable, _ = select.select([], [sock], [], timeout)
+    if not writable:
+        raise socket.timeout('timed out')
+
+###############################################################################################################
+def _chunk_size():
+    """
+    Przy ograniczeniu predkosci wysylamy mniejsze porcje (ratelimit.limiter.quantum)
+    """
+    if ratelimit.limiter.limited():
+        return min(block_size, ratelimit.limiter.quantum())
+    return block_size
+
+
+def _send_file_zero_copy(sock, f, offset, count, progress):
+    out_fd = sock.fileno()
+    in_fd  = f.fileno()
+    sent   = 0
+    while sent < count:
+        try:
+            n = _sendfile(out_fd, in_fd, offset + sent, min(_chunk_size(), count - sent))
+        except OSError, e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                _wait_writable(sock)
+                continue
+            if e.errno in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP) and sent == 0:
+                #np. system plikow nie obsluguje sendfile
+                raise SendfileUnavailable()
+            raise socket.error(e.errno, e.strerror)
+        if n == 0:
+            #plik jest krotszy niz sie spodziewalismy
+            break
+        sent += n
+        _count_sent(n)
+        ratelimit.limiter.acquire(n)
+        if progress is not None:
+            progress(n)
+    return sent
+
+
+_buffers = threading.local()
+
+def _get_buffer():
+    """
+    Bufor wielokrotnego uzytku (osobny dla kazdego watku)
+    """
+    buf = getattr(_buffers, 'buf', None)
+    if buf is None:
+        buf = _buffers.buf = bytearray(block_size)
+    return buf
+
+
+def _send_file_buffered(sock, f, offset, count, progress):
+    buf  = _get_buffer()
+    view = memoryview(buf)
+    f.seek(offset)
+    sent = 0
+    while sent < count:
+        n = f.readinto(view[:min(_chunk_size(), count - sent)])
+        if not n:
+            break
+        sock.sendall(view[:n])
+        sent += n
+        _count_sent(n)
+        ratelimit.limiter.acquire(n)
+        if progress is not None:
+            progress(n)
+    return sent
+
+
+def send_file(sock, f, offset, count, progress = None):
+    """
+    Wysyla przez gniazdo sock count bajtow pliku f, zaczynajac od pozycji offset.
+    progress(n) wywolywane jest po kazdym wyslanym bloku.
+    Predkosc ograniczana jest przez ratelimit.limiter.
+    Zwraca liczbe wyslanych bajtow.
+    """
+    if sendfile_available():
+        try:
+            return _send_file_zero_copy(sock, f, offset, count, progress)
+        except SendfileUnavailable:
+            pass
+    return _send_file_buffered(sock, f, offset, count, progress)
@@ -16,6 +16,14 @@ import traceback
 import model
 import threading
 import select
+import scheduler
+import engine
+import walker
+import pathindex
+import prefetch
+import resolver
+import watch
+from dedup import shared_dedup
 ##########################################
 
 def debug_fun(tb):
@@ -46,22 +54,9 @@ def debug_fun(tb):
 
 
 
-#############################
-class UploaderThread(threading.Thread):
-    def __init__(self, user, password, chomikpath, dirpath, view_, model_, debug=False):
-        threading.Thread.__init__(self)
-        self.uploader   = Uploader(user, password, view_, model_, debug)
-        self.chomikpath = chomikpath
-        self.dirpath    = dirpath
-        self.daemon     = True
-    
-    def run(self):
-        self.uploader.upload_dir(self.chomikpath, self.dirpath)
-        
-        
 #############################
 class Uploader(object):
-    def __init__(self, user = None, password = None, view_ = None, model_ = None, debug = False):
+    def __init__(self, user = None, password = None, view_ = None, model_ = None, debug = False, lazy = False, dedup = False):
         if view_ == None:
             self.view    = view.View()
         else:
@@ -71,11 +66,12 @@ class Uploader(object):
         else:
             self.model   = model_
         self.debug            = debug
+        self.lazy             = lazy
         self.user             = user
         self.password         = password
         self.notuploaded_file = 'notuploaded.txt'
         self.uploaded_file    = 'uploaded.txt'
-        self.chomik = Chomik(self.view, self.model, debug=self.debug)
+        self.chomik = Chomik(self.view, self.model, debug=self.debug, lazy=self.lazy)
         if self.user == None:
             self.user     = raw_input('Podaj nazwe uzytkownika:\n')
         if self.password == None:
@@ -84,15 +80,18 @@ class Uploader(object):
         if not self.chomik.login(self.user, self.password):
             self.view.print_( 'Bledny login lub haslo' )
             sys.exit(1)
+        #pomijanie plikow o zawartosci juz wyslanej na chomika
+        self.dedup = None
+        if dedup:
+            self.dedup = shared_dedup(self.user)
 
 
     
     def upload_file(self, chomikpath, filepath):
-        self.view.print_( 'Zmiana katalogow' )
-        self.chomik.chdirs(chomikpath)
+        folder_id = self.__resolve_root(chomikpath)
         self.view.print_( 'Uploadowanie' )
         try:
-            result = self.chomik.upload(filepath, os.path.basename(filepath))
+            result = self.chomik.upload(filepath, os.path.basename(filepath), folder_id)
         except Exception, e:
             self.view.print_( 'Blad: ', e )
             if self.debug:
@@ -103,6 +102,7 @@ class Uploader(object):
             self.view.print_( 'Zakonczono uploadowanie' )
         else:
             self.view.print_( 'Blad. Plik nie zostal wyslany' )
+        self.print_stats()
             
             
             
@@ -110,46 +110,178 @@ class Uploader(object):
         self.view.print_( 'Wznawianie nieudanych transferow' )
         self.resume()
         self.view.print_( 'Zakonczono probe wznawiania transferow\r\n' )
-        self.view.print_( 'Zmiana katalogow' )
-        lock = self.model.return_chdirlock()
-        lock.acquire()
+        folder_id = self.__resolve_root(chomikpath)
+        owner     = model.Owner()
         try:
-            if not self.chomik.chdirs(chomikpath):
-                self.view.print_( 'Nie udalo sie zmienic katalogu w chomiku', chomikpath )
-                sys.exit(1)
+            for item in self.__items(dirpath, folder_id, prefetch.default_depth, owner = owner):
+                self.upload_item(item)
         finally:
-            lock.release()
-        self.__upload_aux(dirpath)
+            owner.close()
         self.resume()
+        self.print_stats()
+
+
+    def __resolve_root(self, chomikpath):
+        """
+        Zwraca id katalogu chomikpath (tworzac go w razie potrzeby)
+        """
+        self.view.print_( 'Zmiana katalogow' )
+        folder_id = self.chomik.resolve(chomikpath)
+        if folder_id == None:
+            self.view.print_( 'Nie udalo sie zmienic katalogu w chomiku', chomikpath )
+            sys.exit(1)
+        return folder_id
 
 
     
-    def __upload_aux(self, dirpath):
-        """
-        Uploaduje pliki z danego katalogu i jego podkatalogi.
-        """
-        files = [ i for i in os.listdir(dirpath) if os.path.isfile( os.path.join(dirpath, i) ) ]
-        files.sort()
-        dirs  = [ i for i in os.listdir(dirpath) if os.path.isdir( os.path.join(dirpath, i) ) ]
-        dirs.sort()
-        for fil in files:
-            #TODO: przetwarzany jest plik
-            filepath = os.path.join(dirpath, fil)
-            #if not self.model.in_uploaded(filepath):
-            if not self.model.is_uploaded_or_pended_and_add(filepath):
-                self.__upload_file_aux(fil, dirpath)
-                self.model.remove_from_pending(filepath)
-            
-        for dr in dirs:
-            #address = self.chomik.cur_adr
-            address = self.chomik.cur_adr()
-            self.__upload_dir_aux(dirpath,dr)
-            self.chomik.cur_adr(address)
-            #self.chomik.cur_adr = address
+    def __prepare_dirs(self, dirpath, root_id, n):
+        """
+        Tworzy na chomiku (w katalogu root_id) wszystkie brakujace katalogi drzewa dirpath.
+        Katalogi tworzone sa poziom po poziomie, kazdy poziom rownolegle w n watkach.
+        Zwraca slownik: sciezka katalogu na dysku -> id katalogu na chomiku
+        """
+        self.view.print_( 'Tworzenie katalogow' )
+        addresses = { dirpath : root_id }
+        level     = [dirpath]
+        #kazdy katalog (rowniez osiagalny przez dowiazanie) tylko raz
+        visited   = walker.visited_set(dirpath)
+        while level:
+            missing    = []
+            next_level = []
+            for parent in level:
+                parent_id = addresses[parent]
+                for dr in walker.subdirs(parent, visited = visited):
+                    path      = os.path.join(parent, dr)
+                    folder_id = self.chomik.find_dir(dr, parent_id)
+                    if folder_id == None:
+                        missing.append( (path, dr, parent_id) )
+                    else:
+                        addresses[path] = folder_id
+                    next_level.append(path)
+            self.__create_dirs(missing, addresses, n)
+            #podkatalogi, ktorych nie udalo sie utworzyc, sa pomijane
+            level = [ path for path in next_level if path in addresses ]
+        return addresses
+
+
+    def __resolve_dirs(self, parent, paths, addresses, n):
+        """
+        Ustala (lub tworzy w n watkach) katalogi na chomiku dla podkatalogow
+        paths katalogu parent; wynik trafia do addresses
+        """
+        parent_id = addresses[parent]
+        missing   = []
+        for path in paths:
+            if path in addresses:
+                continue
+            dr        = os.path.basename(path)
+            folder_id = self.chomik.find_dir(dr, parent_id)
+            if folder_id == None:
+                missing.append( (path, dr, parent_id) )
+            else:
+                addresses[path] = folder_id
+        self.__create_dirs(missing, addresses, n)
+
+
+    def __create_dirs(self, missing, addresses, n):
+        """
+        Rownolegle tworzenie katalogow z listy missing
+        (elementy: sciezka na dysku, nazwa, id rodzica na chomiku)
+        """
+        if missing == []:
+            return
+        def create(item):
+            path, dr, parent_id = item
+            try:
+                folder_id = self.chomik.mkdir(dr, parent_id)
+            except Exception, e:
+                self.view.print_( 'Blad:', e )
+                if self.debug:
+                    trbck = sys.exc_info()[2]
+                    debug_fun(trbck)
+                folder_id = False
+            if folder_id:
+                addresses[path] = folder_id
+            else:
+                self.view.print_( 'Blad. Nie wyslano katalogu: ', path )
+        if n <= 1:
+            for item in missing:
+                create(item)
+            return
+        sched = scheduler.Scheduler(lambda: create, min(n, len(missing)))
+        sched.start()
+        try:
+            for item in missing:
+                sched.put(item)
+        finally:
+            sched.close()
+        sched.join()
+
+
+    
+    def __walk(self, dirpath, addresses, n = 1, owner = None):
+        """
+        Przechodzi drzewo katalogow i zwraca kolejne pliki do wyslania
+        jako pary (sciezka_pliku, id_katalogu_na_chomiku).
+        addresses - slownik: sciezka katalogu na dysku -> id katalogu na chomiku
+        (zawiera co najmniej dirpath). Brakujace katalogi ustalane sa (i tworzone
+        w n watkach) dopiero, gdy przegladanie do nich dotrze - pliki wysylane
+        sa od razu, bez wczesniejszego przegladania calego drzewa.
+        Podkatalogi, ktorych nie udalo sie utworzyc, sa pomijane.
+        owner - wlasciciel zajmowanych plikow (model.Owner, Pending.claim)
+        """
+        def descend(parent, paths):
+            self.__resolve_dirs(parent, paths, addresses, n)
+            return [ path for path in paths if path in addresses ]
+        for path, entry in walker.walk(dirpath, descend):
+            try:
+                meta = pathindex.file_meta(entry.stat())
+            except OSError:
+                continue
+            if not self.model.is_uploaded_or_pended_and_add(entry.path, meta, owner):
+                yield entry.path, addresses[path]
+
+
+    def __items(self, dirpath, root_id, depth = 0, n = 1, owner = None):
+        """
+        Pliki do wyslania z drzewa dirpath do katalogu root_id na chomiku
+        (bez duplikatow, gdy wlaczono dedup); katalogi tworzone w n watkach.
+        depth > 0 - tokeny dla kolejnych depth plikow pobierane sa z wyprzedzeniem.
+        owner - kolejka, do ktorej trafiaja pliki (model.Owner); pliki pozostaja
+        zajete, dopoki dziala, rowniez po zakonczeniu watku przegladajacego
+        """
+        items = self.__walk(dirpath, { dirpath : root_id }, n, owner)
+        if self.dedup != None:
+            items = self.dedup.filter(items, self.model, self.view)
+        if depth > 0:
+            items = prefetch.Prefetcher(self.chomik, depth).filter(items)
+        return items
+
+
+    def upload_item(self, item):
+        """
+        Wysyla plik z kolejki zadan:
+        item = (sciezka_pliku, id_katalogu_na_chomiku[, klucz_zawartosci[, tokeny]])
+        """
+        filepath, folder_id = item[:2]
+        tokens = None
+        if len(item) > 3:
+            tokens = item[3]
+        result = False
+        self.model.add_to_pending(filepath)
+        try:
+            #stan pliku sprzed wysylania - jezeli plik zmieni sie w trakcie, to zostanie wyslany ponownie
+            meta   = model.file_meta(filepath)
+            result = self.__upload_file_aux(os.path.basename(filepath), os.path.dirname(filepath), folder_id, meta, tokens)
+        finally:
+            self.model.remove_from_pending(filepath)
+            if self.dedup != None and len(item) > 2:
+                self.dedup.finished(item[2], folder_id, os.path.basename(filepath), result)
+        return result
 
 
     
-    def __upload_file_aux(self, fil, dirpath):
+    def __upload_file_aux(self, fil, dirpath, folder_id, meta = None, tokens = None):
         """
         Wysylanie pliku wraz z kontrola bledow.
         W odpowiednim pliku zapisujemy, czy plik zostal poprawnie wyslany
@@ -157,47 +289,27 @@ class Uploader(object):
         filepath = os.path.join(dirpath, fil)
         self.view.print_( 'Uploadowanie pliku:', filepath )
         try:
-            result = self.chomik.upload(filepath, os.path.basename(filepath))
+            result = self.chomik.upload(filepath, os.path.basename(filepath), folder_id, tokens)
         except Exception, e:
             self.view.print_( 'Blad:', e )
             self.view.print_( 'Blad. Plik ',filepath, ' nie zostal wyslany\r\n' )
             if self.debug:
                 trbck = sys.exc_info()[2]
                 debug_fun(trbck)
-            return
+            return False
 
         if result == False:
             self.view.print_( 'Blad. Plik ',filepath, ' nie zostal wyslany\r\n' )
+            return False
         else:
-            self.model.add_uploaded(filepath)
+            self.model.add_uploaded(filepath, meta)
             self.model.remove_notuploaded(filepath)
             self.view.print_( 'Zakonczono uploadowanie\r\n' )
+            return True
 
 
 
     
-    def __upload_dir_aux(self, dirpath,dr):
-        """
-        Zmiana pozycji na chomiku i wyslanie katalogu
-        """
-        lock = self.model.return_chdirlock()
-        lock.acquire()
-        try:
-            changed = self.chomik.chdirs(dr)
-        except Exception, e:
-            self.view.print_( 'Blad. Nie wyslano katalogu: ', os.path.join(dirpath, dr)  )
-            self.view.print_( e )
-            if self.debug:
-                trbck = sys.exc_info()[2]
-                debug_fun(trbck)
-            time.sleep(60)
-            return
-        finally:
-            lock.release()
-        if changed != True:
-            self.view.print_( "Nie udalo sie zmienic katalogu", dr  )
-            return
-        self.__upload_aux( os.path.join(dirpath, dr) )        
     ####################################################################
     
     
@@ -208,7 +320,13 @@ class Uploader(object):
         notuploaded = self.model.get_notuploaded_resume()
         for filepath, filename, folder_id, chomik_id, token, host, port, stamp in notuploaded:
             if not self.model.is_uploaded_or_pended_and_add(filepath):
-                self.__resume_file_aux(filepath, filename, folder_id, chomik_id, token, host, port, stamp)
+                if token == None:
+                    #token nie zostal pobrany - nie ma czego wznawiac; wpis zamieniany
+                    #jest na zwykly (plik zostanie wyslany od nowa z katalogiem)
+                    self.model.remove_notuploaded(filepath)
+                    self.model.add_notuploaded_normal(filepath)
+                else:
+                    self.__resume_file_aux(filepath, filename, folder_id, chomik_id, token, host, port, stamp)
                 self.model.remove_from_pending(filepath)
                 
 
@@ -240,6 +358,9 @@ class Uploader(object):
     ####################################################################
     
     def upload_multi(self, chomikpath, dirpath, n):
+        """
+        Wysyla katalog w n watkach (n == None - liczba watkow dobierana automatycznie)
+        """
         #Bug w pythonie
         #Trzeba wywolac funkcje encoding zanim uruchomi sie watek
         ########################
@@ -254,12 +375,147 @@ class Uploader(object):
         except Exception:
             pass
         #########################
-        th = []
-        for i in xrange(n):
-            upl = UploaderThread(self.user, self.password, chomikpath, dirpath, view_ = self.view, model_ = self.model, debug = self.debug)
-            upl.start()
-        while threading.active_count() > 1:
-            time.sleep(1.)
+        self.view.print_( 'Wznawianie nieudanych transferow' )
+        self.resume()
+        self.view.print_( 'Zakonczono probe wznawiania transferow\r\n' )
+        controller = None
+        if n == None:
+            controller = scheduler.Controller(self.user)
+            n          = controller.limit
+        folder_id = self.__resolve_root(chomikpath)
+        #kazdy watek ma wlasnego uploadera (i polaczenie z chomikiem)
+        def handler_factory():
+            return self.worker().upload_item
+        #tokeny pobrane z wyprzedzeniem wygasaja (upload_token_ttl) - kolejka
+        #zadan nie dluzsza niz liczba watkow, a tokeny pobierane dla jednej
+        #kolejki naprzod, zeby plik byl wysylany wkrotce po pobraniu tokenu
+        sched = scheduler.Scheduler(handler_factory, n, queue_size = n, controller = controller)
+        sched.start()
+        owner = model.Owner()
+        try:
+            try:
+                for item in self.__items(dirpath, folder_id, n, n, owner):
+                    sched.put(item)
+            finally:
+                sched.close()
+            sched.join()
+        finally:
+            owner.close()
+        self.resume()
+        self.print_stats()
+
+    def worker(self):
+        """
+        Nowy uploader dla watku wysylajacego pliki (sesja, indeks katalogow
+        i dziennik sa wspolne, wiec nie wymaga ponownego logowania)
+        """
+        return Uploader(self.user, self.password, self.view, self.model, self.debug, self.lazy, self.dedup != None)
+
+    def dir_items(self, chomikpath, dirpath, n = 1, depth = 0, owner = None):
+        """
+        Zwraca pliki drzewa dirpath do wyslania do katalogu chomikpath (jak
+        __items; katalogi tworzone w n watkach) lub None, gdy nie udalo sie
+        ustalic katalogu na chomiku
+        """
+        folder_id = self.chomik.resolve(chomikpath)
+        if folder_id == None:
+            self.view.print_( 'Nie udalo sie zmienic katalogu w chomiku', chomikpath )
+            return None
+        return self.__items(dirpath, folder_id, depth, n, owner)
+
+    def upload_async(self, chomikpath, dirpath, n):
+        """
+        Jak upload_multi, ale pliki wysylane sa w jednym watku (engine.Engine),
+        najwyzej n jednoczesnie
+        """
+        if n == None:
+            n = engine.default_limit
+        self.view.print_( 'Wznawianie nieudanych transferow' )
+        self.resume()
+        self.view.print_( 'Zakonczono probe wznawiania transferow\r\n' )
+        folder_id = self.__resolve_root(chomikpath)
+        eng   = engine.Engine(self.chomik, self.model, self.view, n, debug = self.debug, dedup = self.dedup)
+        owner = model.Owner()
+        try:
+            eng.run(self.__items(dirpath, folder_id, n = min(n, 8), owner = owner))
+        finally:
+            owner.close()
+        self.resume()
+        self.print_stats()
+
+    def upload_watch(self, chomikpath, dirpath, n):
+        """
+        Wysyla katalog dirpath (w n watkach), a potem obserwuje go (inotify)
+        i wysyla nowe pliki, gdy tylko zostana zapisane. Dziala az do Ctrl+C.
+        """
+        self.view.print_( 'Wznawianie nieudanych transferow' )
+        self.resume()
+        self.view.print_( 'Zakonczono probe wznawiania transferow\r\n' )
+        controller = None
+        if n == None:
+            controller = scheduler.Controller(self.user)
+            n          = controller.limit
+        folder_id = self.__resolve_root(chomikpath)
+        #obserwowanie zaczyna sie przed przegladaniem drzewa - zeby nie
+        #przeoczyc plikow zapisanych w miedzyczasie
+        watcher   = watch.Watcher(dirpath, self.view)
+        def handler_factory():
+            return self.worker().upload_item
+        sched = scheduler.Scheduler(handler_factory, n, controller = controller)
+        sched.start()
+        owner = model.Owner()
+        try:
+            items = self.__watch_items(watcher, dirpath, folder_id, n, owner)
+            if self.dedup != None:
+                items = self.dedup.filter(items, self.model, self.view)
+            for item in items:
+                sched.put(item)
+        finally:
+            watcher.close()
+            sched.close()
+            sched.join()
+            owner.close()
+            self.print_stats()
+
+    def __watch_items(self, watcher, dirpath, root_id, n, owner):
+        """
+        Pliki do wyslania: najpierw cale drzewo dirpath, potem pliki
+        zgloszone przez watcher (watch.Watcher)
+        """
+        addresses = { dirpath : root_id }
+        for item in self.__walk(dirpath, addresses, n, owner):
+            yield item
+        self.view.print_( 'Obserwowanie katalogu', dirpath )
+        for kind, path, name in watcher.events():
+            if kind == 'rescan':
+                for item in self.__walk(dirpath, addresses, owner = owner):
+                    yield item
+                continue
+            parent_id = addresses.get(path)
+            if parent_id == None:
+                continue
+            filepath = os.path.join(path, name)
+            if kind == 'dir':
+                folder_id = self.chomik.find_dir(name, parent_id)
+                if folder_id == None:
+                    folder_id = self.chomik.mkdir(name, parent_id)
+                if folder_id:
+                    addresses.update(self.__prepare_dirs(filepath, folder_id, 1))
+                else:
+                    self.view.print_( 'Blad. Nie wyslano katalogu: ', filepath )
+            else:
+                meta = model.file_meta(filepath)
+                if meta != None and not self.model.is_uploaded_or_pended_and_add(filepath, meta, owner):
+                    yield filepath, parent_id
+
+    def print_stats(self):
+        """
+        Wypisuje statystyki polaczen (tylko w trybie debug)
+        """
+        if self.debug:
+            self.view.print_( 'Pula polaczen SOAP:', soap_pool.stats() )
+            for host, counters in sorted(resolver.resolver.stats().items()):
+                self.view.print_( 'DNS', host + ':', counters )
                 
 if __name__ == '__main__':
     pass
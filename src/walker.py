@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Adam (adam_gr [at] gazeta.pl)
+#
+# Released under: GNU GENERAL PUBLIC LICENSE
+#
+# Ver: 0.5
+
+import os
+import stat
+
+#scandir: os.scandir (python >= 3.5), modul scandir (pip install scandir)
+#lub os.listdir + os.lstat
+try:
+    _scandir = os.scandir
+except AttributeError:
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
+
+
+class _ListdirEntry(object):
+    """
+    Odpowiednik os.DirEntry dla os.listdir (stat pobierany co najwyzej raz)
+    """
+    def __init__(self, dirpath, name):
+        self.name   = name
+        self.path   = os.path.join(dirpath, name)
+        self._lstat = None
+        self._stat  = None
+
+    def _get_lstat(self):
+        if self._lstat is None:
+            self._lstat = os.lstat(self.path)
+        return self._lstat
+
+    def is_symlink(self):
+        return stat.S_ISLNK(self._get_lstat().st_mode)
+
+    def stat(self):
+        if self._stat is None:
+            if self.is_symlink():
+                self._stat = os.stat(self.path)
+            else:
+                self._stat = self._get_lstat()
+        return self._stat
+
+    def is_dir(self):
+        try:
+            return stat.S_ISDIR(self.stat().st_mode)
+        except OSError:
+            return False
+
+    def is_file(self):
+        try:
+            return stat.S_ISREG(self.stat().st_mode)
+        except OSError:
+            return False
+
+
+def scandir(dirpath):
+    """
+    Zwraca wpisy katalogu dirpath (name, path, is_dir(), is_file(), stat())
+    """
+    if _scandir is not None:
+        return _scandir(dirpath)
+    return ( _ListdirEntry(dirpath, name) for name in os.listdir(dirpath) )
+
+
+def _dir_key(st):
+    return (st.st_dev, st.st_ino)
+
+
+def visited_set(top):
+    """
+    Zbior (st_dev, st_ino) odwiedzonych katalogow (dla subdirs) zawierajacy top
+    """
+    try:
+        return set([_dir_key(os.stat(top))])
+    except OSError:
+        return set()
+
+
+def subdirs(dirpath, sort = True, visited = None):
+    """
+    Zwraca nazwy podkatalogow dirpath.
+    visited - zbior z visited_set: pomijane sa katalogi juz w nim zapisane
+    (petle dowiazan symbolicznych), a zwracane sa do niego dodawane
+    """
+    dirs = []
+    for entry in scandir(dirpath):
+        if not entry.is_dir():
+            continue
+        try:
+            key = _dir_key(entry.stat())
+        except OSError:
+            continue
+        dirs.append( (entry.name, key) )
+    if sort:
+        dirs.sort()
+    names = []
+    for name, key in dirs:
+        if visited != None:
+            if key in visited:
+                continue
+            visited.add(key)
+        names.append(name)
+    return names
+
+
+def walk(top, descend = None, sort = True):
+    """
+    Przechodzi (bez rekurencji) drzewo katalogow top i zwraca kolejne pliki
+    jako pary (sciezka_katalogu, wpis).
+    descend(sciezka_katalogu, sciezki) - wywolywane po przejrzeniu katalogu
+    z jego (jeszcze nieodwiedzonymi) podkatalogami; zwraca te z nich,
+    do ktorych nalezy wejsc (domyslnie wszystkie).
+    sort == True - pliki i podkatalogi kazdego katalogu sa sortowane wg nazwy
+    (w pamieci jest wtedy lista wpisow jednego katalogu); przy sort == False
+    pliki zwracane sa od razu, w kolejnosci z systemu plikow.
+    Dowiazania symboliczne do katalogow sa odwiedzane, ale kazdy katalog
+    (st_dev, st_ino) tylko raz - petla dowiazan nie zapetla przegladania.
+    """
+    visited = visited_set(top)
+    stack   = [top]
+    while stack:
+        dirpath = stack.pop()
+        try:
+            entries = scandir(dirpath)
+        except OSError:
+            continue
+        files = []
+        dirs  = []
+        for entry in entries:
+            if entry.is_file():
+                if sort:
+                    files.append(entry)
+                else:
+                    yield dirpath, entry
+            elif entry.is_dir():
+                try:
+                    dirs.append( (entry.name, _dir_key(entry.stat())) )
+                except OSError:
+                    pass
+        if sort:
+            files.sort(key = lambda entry: entry.name)
+            for entry in files:
+                yield dirpath, entry
+            dirs.sort()
+        paths = []
+        for name, key in dirs:
+            if key in visited:
+                continue
+            visited.add(key)
+            paths.append(os.path.join(dirpath, name))
+        if descend is not None and paths:
+            paths = descend(dirpath, paths)
+        #odwrotna kolejnosc - ze stosu katalogi zdejmowane sa alfabetycznie
+        stack.extend(reversed(paths))
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Adam (adam_gr [at] gazeta.pl)
+#
+# Released under: GNU GENERAL PUBLIC LICENSE
+#
+# Ver: 0.5
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+import model
+import walker
+
+#zdarzenia inotify (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_ONLYDIR     = 0x01000000
+IN_ISDIR       = 0x40000000
+IN_NONBLOCK    = 0x00000800
+IN_CLOEXEC     = 0x00080000
+
+_event = struct.Struct('iIII')
+
+_libc = None
+
+
+def _load_libc():
+    global _libc
+    if _libc == None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno = True)
+        if not hasattr(_libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify jest niedostepne')
+    return _libc
+
+
+def _check(result):
+    if result < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return result
+
+
+class Inotify(object):
+    """
+    Deskryptor inotify (przez ctypes - tylko linux)
+    """
+    def __init__(self):
+        self.libc = _load_libc()
+        self.fd   = _check(self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask):
+        return _check(self.libc.inotify_add_watch(self.fd, path, mask))
+
+    def read(self):
+        """
+        Zwraca liste zdarzen (wd, mask, cookie, nazwa)
+        """
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError, e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return []
+            raise
+        events = []
+        offset = 0
+        while offset + _event.size <= len(data):
+            wd, mask, cookie, length = _event.unpack_from(data, offset)
+            offset += _event.size
+            name    = data[offset:offset + length].rstrip('\0')
+            offset += length
+            events.append( (wd, mask, cookie, name) )
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher(object):
+    """
+    Obserwowanie (inotify) drzewa katalogow top wraz z nowo utworzonymi
+    podkatalogami. Plik zglaszany jest, gdy jest juz stabilny: zostal
+    zamkniety po zapisie (lub przeniesiony do drzewa) i przez settle sekund
+    nie zmienil sie jego rozmiar ani czas modyfikacji.
+    Koszt nie zalezy od wielkosci drzewa - nie jest ono ponownie przegladane.
+    """
+    mask   = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_ONLYDIR
+    #ile sekund plik musi byc niezmieniony, zeby go wyslac
+    settle = 1.
+
+    def __init__(self, top, view_ = None):
+        self.top      = top
+        self.view     = view_
+        self.inotify  = Inotify()
+        #wd -> sciezka katalogu
+        self.dirs     = {}
+        #(sciezka katalogu, nazwa pliku) -> (termin, stan pliku)
+        self.pending  = {}
+        #zdarzenia do zwrocenia przez events
+        self.ready    = []
+        self.add_tree(top)
+
+    def add_tree(self, top):
+        """
+        Dodaje obserwowanie katalogu top i wszystkich jego podkatalogow.
+        Zwraca liste (sciezka katalogu, nazwa pliku) plikow, ktore juz sa w drzewie
+        """
+        files   = []
+        stack   = [top]
+        #(st_dev, st_ino) odwiedzonych katalogow - petle dowiazan symbolicznych
+        visited = set()
+        while stack:
+            path = stack.pop()
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if (st.st_dev, st.st_ino) in visited:
+                continue
+            visited.add( (st.st_dev, st.st_ino) )
+            try:
+                wd = self.inotify.add_watch(path, self.mask)
+            except OSError, e:
+                #np. przekroczony limit fs.inotify.max_user_watches
+                if self.view != None:
+                    self.view.print_( 'Nie mozna obserwowac katalogu', path, ':', e )
+                continue
+            self.dirs[wd] = path
+            try:
+                entries = list(walker.scandir(path))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir():
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    files.append( (path, entry.name) )
+        return files
+
+    def close(self):
+        self.inotify.close()
+
+    def schedule(self, dirpath, name):
+        path = os.path.join(dirpath, name)
+        self.pending[(dirpath, name)] = (time.time() + self.settle, model.file_meta(path))
+
+    def events(self):
+        """
+        Zwraca (bez konca) kolejne zdarzenia:
+        ('file', katalog, nazwa) - stabilny plik do wyslania,
+        ('dir', katalog, nazwa) - nowy podkatalog (juz obserwowany; jego pliki
+        zostana zgloszone osobno),
+        ('rescan', top, None) - utracono zdarzenia, trzeba przejrzec cale drzewo
+        """
+        while True:
+            while self.ready:
+                yield self.ready.pop(0)
+            now     = time.time()
+            timeout = None
+            for key, (deadline, meta) in sorted(self.pending.items()):
+                if deadline > now:
+                    if timeout == None or deadline - now < timeout:
+                        timeout = deadline - now
+                    continue
+                current = model.file_meta(os.path.join(*key))
+                if current == None:
+                    #plik zostal usuniety
+                    del self.pending[key]
+                elif current != meta:
+                    #plik wciaz sie zmienia
+                    self.pending[key] = (now + self.settle, current)
+                    if timeout == None or self.settle < timeout:
+                        timeout = self.settle
+                else:
+                    del self.pending[key]
+                    self.ready.append( ('file', key[0], key[1]) )
+            if self.ready:
+                continue
+            try:
+                readable, _, _ = select.select([self.inotify], [], [], timeout)
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if readable:
+                for event in self.inotify.read():
+                    self.__handle(*event)
+
+    def __handle(self, wd, mask, cookie, name):
+        if mask & IN_Q_OVERFLOW:
+            #kolejka zdarzen przepelniona - obserwowanie nowych katalogow
+            #i pelne przejrzenie drzewa
+            self.add_tree(self.top)
+            self.ready.append( ('rescan', self.top, None) )
+            return
+        dirpath = self.dirs.get(wd)
+        if mask & IN_IGNORED or mask & IN_DELETE_SELF:
+            self.dirs.pop(wd, None)
+            return
+        if dirpath == None or name == '':
+            return
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self.ready.append( ('dir', dirpath, name) )
+                for key in self.add_tree(os.path.join(dirpath, name)):
+                    self.schedule(*key)
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            self.schedule(dirpath, name)